@@ -3,6 +3,9 @@ import sys
 import logging
 import argparse
 import importlib.util
+from functools import partial
+from itertools import count
+from typing import Callable, Iterator
 
 try:
     import yaml
@@ -10,6 +13,11 @@ except ImportError:
     sys.exit('pyyaml is required for Batchout CLI; have you run `pip install batchout[cli]`?')
 
 from . import Batch
+from .core.metrics import MetricsServer, write_textfile
+from .core.profiling import PROFILERS
+
+
+log = logging.getLogger(__name__)
 
 
 def readable_file(path: str) -> str:
@@ -26,6 +34,28 @@ def available_python_module(name: str) -> str:
         raise argparse.ArgumentTypeError('module not found: %s', name)
 
 
+def dump_stats(path: str, batch: Batch) -> None:
+    if path == '-':
+        print(batch.stats.to_json(), flush=True)
+        return
+    with open(path, mode='a') as f:
+        f.write(batch.stats.to_json() + '\n')
+
+
+def dump_metrics(path: str, batch: Batch) -> None:
+    write_textfile(batch.metrics, path)
+
+
+def dump_profile(profiler, path: str, runs: Iterator[int], _: Batch) -> None:
+    profiler.dump(path.format(run=next(runs)))
+    profiler.clear()
+
+
+def call_each(callbacks: list[Callable[[Batch], None]], batch: Batch) -> None:
+    for callback in callbacks:
+        callback(batch)
+
+
 def main() -> None:
     argparser = argparse.ArgumentParser(description='Run Batchout from a config file (YAML)')
     argparser.add_argument(
@@ -48,6 +78,39 @@ def main() -> None:
         '-W', '--max-wait-sec', default=1, type=int,
         help='Maximum seconds to wait between batches',
     )
+    argparser.add_argument(
+        '-s', '--stats', type=str,
+        help='Append timings and counters of each batch as a JSON line to a file, use - for stdout',
+    )
+    argparser.add_argument(
+        '-p', '--profile', choices=tuple(PROFILERS),
+        help='Profile batches with cProfile (pstats report) or by sampling stacks of all threads (collapsed stacks)',
+    )
+    argparser.add_argument(
+        '--profile-output', type=str,
+        help='Path to write profiling report to, '
+             '"{run}" in path is replaced by a number of batch with --profile-per-run',
+    )
+    argparser.add_argument(
+        '--profile-per-run', action='store_true',
+        help='Write profiling report after each batch instead of a cumulative one on exit',
+    )
+    argparser.add_argument(
+        '--profile-interval-ms', default=5, type=float,
+        help='Interval between samples for sampling profiler',
+    )
+    argparser.add_argument(
+        '--metrics-port', type=int,
+        help='Serve metrics of batches in Prometheus text format on this port',
+    )
+    argparser.add_argument(
+        '--metrics-host', default='', type=str,
+        help='Address to bind metrics server to (all interfaces by default)',
+    )
+    argparser.add_argument(
+        '--metrics-textfile', type=str,
+        help='Rewrite metrics of batches in Prometheus text format to a file after each batch',
+    )
     argparser.add_argument(
         '-l', '--log-level', default=logging.INFO, type=int,
         help=f"Choose logging level between {logging.DEBUG} (DEBUG) and {logging.FATAL} (FATAL)",
@@ -58,9 +121,48 @@ def main() -> None:
         logging.Formatter('%(asctime)s %(levelname)-5s %(name)-30s %(message)s')
     )
     logging.getLogger().setLevel(args.log_level)
-    for target in args.import_from:
+    for target in args.import_from or []:
         importlib.import_module(target)
     config = yaml.load(open(args.config), yaml.Loader)
     defaults = config.pop('defaults') if 'defaults' in config else {}
     batch = Batch.from_config(config, defaults)
-    batch.run_forever(max_runs=args.num_batches, min_wait_sec=args.min_wait_sec, max_wait_sec=args.max_wait_sec)
+    callbacks = []
+    if args.stats:
+        batch.with_stats()
+        callbacks.append(partial(dump_stats, args.stats))
+    metrics_server = None
+    if args.metrics_port is not None or args.metrics_textfile:
+        batch.with_metrics()
+        if args.metrics_textfile:
+            callbacks.append(partial(dump_metrics, args.metrics_textfile))
+        if args.metrics_port is not None:
+            metrics_server = MetricsServer(batch.metrics, args.metrics_port, args.metrics_host).start()
+            log.info('serving metrics on port %d', metrics_server.port)
+    profiler, profile_output = None, None
+    if args.profile:
+        if args.profile == 'sampling':
+            profiler = PROFILERS[args.profile](args.profile_interval_ms / 1000)
+        else:
+            profiler = PROFILERS[args.profile]()
+            if any(reader['threads'] > 1 for reader in batch.readers.values()):
+                log.warning('cprofile only sees the main thread, use sampling to profile readers with threads > 1')
+        profile_output = args.profile_output or f'batchout.{"pstats" if args.profile == "cprofile" else "folded"}'
+        if args.profile_per_run:
+            if '{run}' not in profile_output:
+                profile_output += '.{run}'
+            callbacks.append(partial(dump_profile, profiler, profile_output, count(1)))
+        batch.with_profiler(profiler)
+    try:
+        batch.run_forever(
+            max_runs=args.num_batches,
+            min_wait_sec=args.min_wait_sec,
+            max_wait_sec=args.max_wait_sec,
+            callback=partial(call_each, callbacks) if callbacks else None,
+        )
+    finally:
+        if profiler is not None and not args.profile_per_run:
+            profiler.dump(profile_output)
+        if args.metrics_textfile:
+            dump_metrics(args.metrics_textfile, batch)
+        if metrics_server is not None:
+            metrics_server.stop()
@@ -1,21 +1,26 @@
 from __future__ import annotations
 
+import heapq
 import itertools
 import logging
 import random
 import time
-from collections import OrderedDict, defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from functools import partial
-from itertools import chain, takewhile, repeat
-from operator import is_not
+from itertools import islice
 from typing import Optional
 
+from .concurrency import AdaptiveLimit
 from .data import Data
+from .metrics import Metrics
+from .progress import Progress
 from .registry import Registry
+from .stats import NO_STATS, Stats
 from .util import as_list, Map
 from ..std import (
     Input,
+    FetchRetryable,
     Extractor,
     Index,
     Column,
@@ -27,6 +32,9 @@ from ..std import (
 
 log = logging.getLogger(__name__)
 
+# combinations of index subtrees kept in memory for one payload, subtrees that do not fit are streamed
+MAX_MEMOIZED_COMBINATIONS = 100000
+
 
 class ChangedComponentsAfterFirstRun(Exception):
     pass
@@ -36,6 +44,20 @@ class UndefinedComponentReference(Exception):
     pass
 
 
+# a read that failed with FetchRetryable keeps its clones and rows, so that its retry resumes from the failed fetch
+class _ReadState:
+
+    __slots__ = ('inputs', 'latest', 'stats', 'finished', 'fetched', 'retries')
+
+    def __init__(self):
+        self.inputs = None
+        self.latest = None
+        self.stats = NO_STATS
+        self.finished = set()
+        self.fetched = 0
+        self.retries = 0
+
+
 def _raise_if_called_after_reset(method):
     def wrapped(self, *args, **kwargs):
         if self._reset_cnt > 0:
@@ -77,6 +99,15 @@ class Batch:
         self._reset_cnt = 0
         self._validated = False
         self._input_configs = {}
+        self._input_state = {}
+        self._column_plan = ()
+        self._row_plans = {}
+        self._extractor_names = {}
+        self._collect_stats = False
+        self._stats = None
+        self._profiler = None
+        self._metrics = None
+        self._limits = {}
 
     def _create_components(self, ctype, current, configs):
         for k, c in configs.items():
@@ -127,6 +158,26 @@ class Batch:
         self._maps = {iname: Map([], *as_list(elements)) for iname, elements in configs.items()}
         return self
 
+    def with_stats(self, enabled: bool = True):
+        self._collect_stats = enabled
+        return self
+
+    @property
+    def stats(self) -> Optional[Stats]:
+        return self._stats
+
+    def with_metrics(self, metrics: Optional[Metrics] = None):
+        self._metrics = metrics if metrics is not None else Metrics()
+        return self
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        return self._metrics
+
+    def with_profiler(self, profiler):
+        self._profiler = profiler
+        return self
+
     @property
     def readers(self):
         return OrderedDict(sorted(
@@ -150,6 +201,8 @@ class Batch:
             Input, cloned_inputs,
             {name: dict(config) for name, config in self._input_configs.items() if name in input_names}
         )
+        for name, cloned_input in cloned_inputs.items():
+            cloned_input.share_state(self._inputs[name])
         return cloned_inputs
 
     @property
@@ -161,8 +214,9 @@ class Batch:
         self._last_data.reset().with_sources(*self._inputs.keys())
         self._reset_cnt += 1
 
-    def _log(self, msg, *args, __level=logging.INFO, **kwargs):
-        log.log(__level, f'R{self._reset_cnt:03}: {msg}', *args, **kwargs)
+    def _log(self, msg, *args, level=logging.INFO, **kwargs):
+        if log.isEnabledFor(level):
+            log.log(level, f'R{self._reset_cnt:03}: {msg}', *args, **kwargs)
 
     def _init_data(self):
         col_types = {k: c.bound_name for k, c in self._columns.items()}
@@ -197,23 +251,58 @@ class Batch:
                 raise UndefinedComponentReference(
                     f"column {column} references extractor {extractor} which is undefined"
                 )
+        for each_input in self._inputs.values():
+            each_input.share_batch_state(self._input_state)
+        self._column_plan = tuple((name, col, self._get_column_extractor(name)) for name, col in self._columns.items())
+        self._row_plans = {}
+        self._extractor_names = {id(extractor): name for name, extractor in self._extractors.items()}
         self._validated = True
 
     def run_once(self):
+        if self._profiler is not None:
+            self._profiler.start()
+        try:
+            return self._run_once()
+        except Exception as e:
+            if self._metrics is not None:
+                self._metrics.inc('batchout_batches_failed_total', help_='Batches interrupted by an exception',
+                                  error=type(e).__name__)
+            raise
+        finally:
+            if self._profiler is not None:
+                self._profiler.stop()
+
+    def _run_once(self):
         self._validate_components()
+        # metrics are fed from stats of each run
+        stats = Stats() if self._collect_stats or self._metrics is not None else NO_STATS
 
         read_selectors = [v['selector'] for v in list(self.readers.values()) if v['selector']]
         write_selectors = [v['selector'] for v in self.writers.values() if v['selector']]
 
-        selections_to_read = self._prepare_selections(self.last, *read_selectors)
+        for each_input in self._inputs.values():
+            # whatever was staged by a failed batch is forgotten, so that its payloads are read again
+            each_input.rollback()
+            hashes = each_input.content_hashes()
+            if hashes is not None:
+                hashes.rollback()
+
+        selections_to_read = self._prepare_selections(self.last, *read_selectors, stats=stats)
         self._reset_last()
 
         for reader_name, reader_components in self.readers.items():
-            read_inputs, using_selector, max_threads = (
-                reader_components['inputs'], reader_components['selector'], reader_components['threads']
+            read_inputs, using_selector, max_threads, max_combinations, progress_sec = (
+                reader_components['inputs'], reader_components['selector'], reader_components['threads'],
+                reader_components.get('max_index_combinations'), reader_components.get('progress_sec'),
+            )
+            min_threads, retry_deadline_sec = (
+                reader_components.get('min_threads'), reader_components.get('retry_deadline_sec'),
             )
+            if min_threads is not None and min_threads < max_threads and reader_name not in self._limits:
+                # limits are kept between batches, so each batch starts where the previous one has settled
+                self._limits[reader_name] = AdaptiveLimit(min_threads, max_threads)
             if using_selector and self.last.count() > 0:
-                selections_to_read.update(self._prepare_selections(self.last, using_selector))
+                selections_to_read.update(self._prepare_selections(self.last, using_selector, stats=stats))
 
             pkeys, pvals_set = selections_to_read[using_selector] if using_selector else ([], [[]])
             if pkeys and pvals_set:
@@ -222,140 +311,449 @@ class Batch:
             else:
                 self._log(f"{reader_name}: fetching from {', '.join(read_inputs)}")
 
-            self._read_all(reader_name, read_inputs, max_threads, pkeys, pvals_set)
+            started = time.perf_counter()
+            self._read_all(
+                reader_name, read_inputs, max_threads, pkeys, pvals_set, max_combinations, stats, progress_sec,
+                retry_deadline_sec,
+            )
+            stats.add('task', reader_name, 'read', time.perf_counter() - started)
 
             for read_input in read_inputs:
                 self._inputs[read_input].reset()
 
-        selections_to_write = self._prepare_selections(self.last, *write_selectors)
-        self._write_outputs(selections_to_write)
+        selections_to_write = self._prepare_selections(self.last, *write_selectors, stats=stats)
+        self._write_outputs(selections_to_write, stats)
 
-        for each_input in tuple(self._inputs.values()):
+        for input_name, each_input in tuple(self._inputs.items()):
+            started = time.perf_counter()
             each_input.commit()
-
+            hashes = each_input.content_hashes()
+            if hashes is not None:
+                hashes.commit()
+            stats.add('input', input_name, 'commit', time.perf_counter() - started)
+
+        stats.finish()
+        if self._collect_stats:
+            self._stats = stats
+        if self._metrics is not None:
+            self._record_metrics(stats)
         return self
 
-    def _prepare_selections(self, data: Data, *names):
-        return {
-            name: (selector.columns(), [row for row in selector.apply(data) if any(filter(None, row))])
-            for name, selector in self._selectors.items()
-            if name in names
-        }
-
-    def _read_all(self, reader_name, read_inputs, max_threads, pkeys, pvals_set):
+    def _record_metrics(self, stats: Stats):
+        metrics = self._metrics
+        metrics.inc('batchout_batches_total', help_='Batches completed')
+        metrics.observe('batchout_batch_duration_seconds', stats.seconds, help_='Wall time of a batch')
+        for entry in stats.entries():
+            labels = {'role': entry['role'], 'name': entry['name'], 'stage': entry['stage']}
+            metrics.inc('batchout_calls_total', entry['calls'], help_='Calls of a component', **labels)
+            metrics.inc('batchout_seconds_total', entry['seconds'], help_='Time spent in a component', **labels)
+            metrics.inc('batchout_rows_total', entry['rows'], help_='Rows handled by a component', **labels)
+            metrics.inc('batchout_bytes_total', entry['bytes'], help_='Bytes handled by a component', **labels)
+            if entry['role'] == 'task':
+                metrics.observe('batchout_task_duration_seconds', entry['seconds'], help_='Wall time of a task',
+                                task=entry['name'], stage=entry['stage'])
+
+    def _prepare_selections(self, data: Data, *names, stats=NO_STATS):
+        # pending rows are inserted into SQLite on first query, so it is measured separately from selectors
+        started = time.perf_counter()
+        data.cursor
+        stats.add('data', 'sqlite', 'insert', time.perf_counter() - started)
+        selections = {}
+        for name, selector in self._selectors.items():
+            if name not in names:
+                continue
+            started = time.perf_counter()
+            rows = [row for row in selector.apply(data) if any(filter(None, row))]
+            stats.add('selector', name, 'apply', time.perf_counter() - started, rows=len(rows))
+            selections[name] = (selector.columns(), rows)
+        return selections
+
+    def _read_all(
+        self, reader_name, read_inputs, max_threads, pkeys, pvals_set, max_combinations=None, stats=NO_STATS,
+        progress_sec=None, retry_deadline_sec=None,
+    ):
+        params_set = [dict(zip(pkeys, pvals)) for pvals in pvals_set or [[]]]
+        with_stats = stats is not NO_STATS
+        if max_threads == 1:
+            # a single reader runs in the calling thread, which is also where profilers are attached
+            results = self._schedule_reads(
+                None, reader_name, read_inputs, params_set, 1, max_combinations, with_stats, retry_deadline_sec,
+            )
+            self._merge_read(reader_name, read_inputs, results, len(params_set), stats, progress_sec)
+            return
         with ThreadPoolExecutor(max_workers=max_threads) as executor:
-            fetch_tasks = [
-                executor.submit(self._read_one, read_inputs, params)
-                for idx, params
-                in enumerate((
-                    dict(zip(pkeys, pvals))
-                    for pvals
-                    in pvals_set or [[]]
-                ))
-            ]
-            for idx, fut in enumerate(as_completed(fetch_tasks)):
-                params, rows_set = fut.result()
-                for source, rows in zip(read_inputs, rows_set):
-                    self.last.with_row(source, *rows)
+            results = self._schedule_reads(
+                executor, reader_name, read_inputs, params_set, max_threads, max_combinations, with_stats,
+                retry_deadline_sec,
+            )
+            self._merge_read(reader_name, read_inputs, results, len(params_set), stats, progress_sec)
+
+    def _submit_read(self, executor, *args):
+        if executor is not None:
+            return executor.submit(self._read_one, *args)
+        fut = Future()
+        try:
+            fut.set_result(self._read_one(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        return fut
+
+    def _schedule_reads(
+        self, executor, reader_name, read_inputs, params_set, max_threads, max_combinations, with_stats,
+        retry_deadline_sec=None,
+    ):
+        limit = self._limits.get(reader_name)
+        # failed reads and reads waiting for rate limits are kept in a heap until they are due,
+        # reads of other params go on meanwhile
+        ready = deque((params, 0, None, None, _ReadState()) for params in params_set)
+        delayed, pending = [], {}
+        delayed_cnt = itertools.count()
+        throttled = 0
+        try:
+            while ready or delayed or pending:
+                now = time.monotonic()
+                while delayed and delayed[0][0] <= now:
+                    _, _, params, attempt, failed_at, waited, read = heapq.heappop(delayed)
+                    if waited:
+                        # tokens are reserved for this read already, it goes first
+                        throttled -= 1
+                        ready.appendleft((params, attempt, failed_at, waited, read))
+                    else:
+                        ready.append((params, attempt, failed_at, waited, read))
+                # reads waiting for rate limits take their slots, so that tokens are not reserved far ahead
+                while ready and len(pending) + throttled < (max_threads if limit is None else limit.limit):
+                    params, attempt, failed_at, waited, read = ready.popleft()
+                    if waited is None:
+                        waited = max(self._inputs[name].reserve_read() for name in read_inputs)
+                        if waited > 0:
+                            heapq.heappush(
+                                delayed, (now + waited, next(delayed_cnt), params, attempt, failed_at, waited, read),
+                            )
+                            throttled += 1
+                            continue
+                    fetched = read.fetched
+                    fut = self._submit_read(executor, read_inputs, params, read, max_combinations, with_stats)
+                    pending[fut] = (time.perf_counter(), params, attempt, failed_at, waited, read, fetched)
+                if limit is not None and self._metrics is not None:
+                    self._metrics.set('batchout_reader_threads', limit.limit, help_='Parallel reads allowed by now',
+                                      task=reader_name)
+                if not pending:
+                    time.sleep(max(0.0, delayed[0][0] - now))
+                    continue
+                timeout = max(0.0, delayed[0][0] - now) if delayed else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    started, params, attempt, failed_at, waited, read, fetched = pending.pop(fut)
+                    try:
+                        result = fut.result()
+                    except FetchRetryable as e:
+                        if limit is not None:
+                            limit.on_result(started, time.perf_counter() - started, failed=e.throttled)
+                        if read.fetched > fetched:
+                            # read got past the fetch that failed before, so this failure has retries of its own
+                            attempt, failed_at = 0, None
+                        now = time.monotonic()
+                        failed_at = failed_at or now
+                        delay = max(
+                            e.retry_after_sec or 0.0, min(e.max_backoff_sec, 2 ** attempt) * random.uniform(0.5, 1),
+                        )
+                        if attempt >= e.retries or (
+                            retry_deadline_sec is not None and now + delay - failed_at > retry_deadline_sec
+                        ):
+                            self._release_read(read)
+                            raise
+                        self._log('%s: retrying %sin %.1f seconds after %s: %s', reader_name,
+                                  ''.join(f'({k}={v}) ' for k, v in params.items()), delay, type(e).__name__, e,
+                                  level=logging.WARNING)
+                        read.retries += 1
+                        heapq.heappush(
+                            delayed, (now + delay, next(delayed_cnt), params, attempt + 1, failed_at, None, read),
+                        )
+                        continue
+                    if limit is not None:
+                        limit.on_result(started, time.perf_counter() - started, failed=False)
+                    if read.retries or waited:
+                        params, latest, read_stats, counters = result
+                        counters = dict(counters)
+                        if read.retries:
+                            counters.update(retries=read.retries, errors=counters.get('errors', 0) + read.retries)
+                            read_stats.add('task', reader_name, 'retry', calls=read.retries)
+                        if waited:
+                            counters['rate_waits'] = counters.get('rate_waits', 0) + 1
+                            read_stats.add('task', reader_name, 'rate_wait', waited)
+                        result = params, latest, read_stats, counters
+                    yield result
+        except BaseException:
+            # reads waiting for a retry are not resumed anymore
+            for entry in itertools.chain(ready, delayed):
+                self._release_read(entry[-1])
+            for fut, entry in pending.items():
+                fut.add_done_callback(partial(self._release_failed_read, entry[5]))
+            raise
+
+    def _release_read(self, read: _ReadState):
+        # commit() is not called for clones of a failed read, they are reset to close what they hold open
+        for cloned_input in (read.inputs or {}).values():
+            cloned_input.reset()
+
+    def _release_failed_read(self, read: _ReadState, fut: Future):
+        if isinstance(fut.exception(), FetchRetryable):
+            self._release_read(read)
+
+    def _merge_read(self, reader_name, read_inputs, results, total, stats=NO_STATS, progress_sec=None):
+        progress = Progress(total, progress_sec) if progress_sec is not None else None
+        read_level = logging.INFO if progress is None else logging.DEBUG
+        log_reads = log.isEnabledFor(read_level)
+        for idx, (params, latest, read_stats, counters) in enumerate(results):
+            if self._metrics is not None:
+                self._metrics.set('batchout_reader_pending', total - idx - 1, help_='Reads not merged yet',
+                                  task=reader_name)
+            stats.merge(read_stats)
+            for source in read_inputs:
+                started = time.perf_counter()
+                self.last.with_data(latest, source)
+                stats.add('data', source, 'merge', time.perf_counter() - started, rows=latest.count(source))
+                if log_reads:
                     self._log(
-                        f"{reader_name}[{idx + 1:04}/{len(fetch_tasks):04}]: "
-                        f"{''.join(f'({k}={v}) ' for k, v in params.items())}"
-                        f"read {len(rows)} records from {source}, new total is {self.last.count(source)}"
+                        '%s[%04d/%04d]: %sread %d records from %s, new total is %d',
+                        reader_name, idx + 1, total, ''.join(f'({k}={v}) ' for k, v in params.items()),
+                        latest.count(source), source, self.last.count(source), level=read_level,
                     )
-
-    def _read_one(self, read_inputs, params):
-        cloned_inputs = self._clone_inputs(*read_inputs)
-        latest = self._init_data()
-        for reading_input, payload in self._fetch_from_inputs(params, **cloned_inputs):
-            for row_cols, idx_vals in self._parse(payload, reading_input):
-                row = self._build_row(payload, row_cols, idx_vals)
-                if any(filter(None, row)):
-                    latest.with_row(reading_input, row)
-        for cloned_input in cloned_inputs.values():
+            if progress is not None and progress.update(latest.count(*read_inputs), counters.get('errors', 0)):
+                self._log('%s: %s', reader_name, progress.line())
+
+    def _read_one(self, read_inputs, params, read, max_combinations=None, with_stats=False):
+        if read.inputs is None:
+            read.inputs = self._clone_inputs(*read_inputs)
+            read.latest = self._init_data()
+            read.stats = Stats() if with_stats else NO_STATS
+        else:
+            # retry resumes with the same clones, they also take tokens reserved for it
+            for name, cloned_input in read.inputs.items():
+                cloned_input.share_state(self._inputs[name])
+        try:
+            self._parse_inputs(read, params, max_combinations)
+        except FetchRetryable:
+            raise
+        except BaseException:
+            self._release_read(read)
+            raise
+        cloned_inputs, latest, stats = read.inputs, read.latest, read.stats
+        counters = {}
+        for name, cloned_input in cloned_inputs.items():
             cloned_input.commit()
-        return params, [latest.rows(src) for src in read_inputs]
-
-    @staticmethod
-    def _fetch_from_inputs(params, **inputs):
-        yield from chain.from_iterable(
-            zip(
-                repeat(name),
-                takewhile(partial(is_not, None), (i.fetch(**(params or {})) for params in repeat(params)))
-            )
-            for name, i in inputs.items()
-        )
-
-    def _parse(self, payload, from_input):
+            for counter, value in cloned_input.counters().items():
+                if not value:
+                    continue
+                counters[counter] = counters.get(counter, 0) + value
+                stats.add('input', name, counter, calls=value)
+        return params, latest, stats, counters
+
+    def _parse_inputs(self, read, params, max_combinations=None):
+        latest, stats = read.latest, read.stats
+        for reading_input, payload in self._fetch_from_inputs(params, read.inputs, stats, read.finished):
+            read.fetched += 1
+            hashes = read.inputs[reading_input].content_hashes()
+            if hashes is not None and hashes.seen(hashes.digest(payload)):
+                stats.add('input', reading_input, 'skip', size=len(payload))
+                continue
+            started, rows = time.perf_counter(), latest.count(reading_input)
+            try:
+                for row_cols, idx_vals in self._parse(payload, reading_input, max_combinations, stats):
+                    row = self._build_row(payload, row_cols, idx_vals, stats)
+                    if any(filter(None, row)):
+                        latest.with_row(reading_input, row)
+            finally:
+                for extractor in self._extractors.values():
+                    extractor.release(payload)
+            rows = latest.count(reading_input) - rows
+            stats.add('input', reading_input, 'parse', time.perf_counter() - started, rows=rows)
+
+    def _fetch_from_inputs(self, params, inputs, stats=NO_STATS, finished=None):
+        for name, i in inputs.items():
+            if finished is not None and name in finished:
+                continue
+            while True:
+                started = time.perf_counter()
+                try:
+                    payload = i.fetch(**(params or {}))
+                except Exception as e:
+                    if self._metrics is not None:
+                        self._metrics.inc('batchout_fetch_errors_total', help_='Fetches failed with an exception',
+                                          input=name, error=type(e).__name__)
+                    raise
+                if self._metrics is not None:
+                    self._metrics.observe('batchout_fetch_duration_seconds', time.perf_counter() - started,
+                                          help_='Wall time of a fetch', input=name)
+                if payload is None:
+                    stats.add('input', name, 'fetch', time.perf_counter() - started)
+                    if finished is not None:
+                        finished.add(name)
+                    break
+                stats.add('input', name, 'fetch', time.perf_counter() - started, size=len(payload))
+                yield name, payload
+
+    def _index_values(self, name, payload, stats, **indexes):
+        index, extractor = self._indexes[name], self._get_index_extractor(name)
+        started = time.perf_counter()
+        values = index.values(extractor, payload, **indexes)
+        stats.add('index', name, 'extract', time.perf_counter() - started, rows=len(values))
+        return values
+
+    def _parse(self, payload, from_input, max_combinations=None, stats=NO_STATS):
         if from_input not in self._maps:
             return
+        emitted = 0
         for branch in self._maps[from_input]:
-            context = defaultdict(dict)
-            columns = []
+            context = {}
+            columns = set()
             for path, deps in branch:
                 if path in self._indexes:
                     if not deps:
-                        context[path] = {
-                            v: defaultdict(dict)
-                            for v in self._indexes[path].values(self._get_index_extractor(path), payload)
-                        }
+                        context[path] = {v: {} for v in self._index_values(path, payload, stats)}
                         continue
-                    for indexes in self._build_indexes(context):
-                        first_dep, *other_deps = deps
-                        outer = context[first_dep]
-                        inner = outer[indexes[first_dep]]
-                        for last_dep in other_deps:
-                            outer = inner.setdefault(last_dep, defaultdict(dict))
-                            inner = outer.setdefault(indexes[last_dep], defaultdict(dict))
-                        inner[path] = {
-                            v: defaultdict(dict)
-                            for v in self._indexes[path].values(self._get_index_extractor(path), payload, **indexes)
-                        }
+                    indexes = {}
+                    for inner in self._walk_indexes(context, deps, indexes):
+                        inner[path] = {v: {} for v in self._index_values(path, payload, stats, **indexes)}
                 elif path in self._columns:
-                    columns.append(path)
-            if not context:
-                yield tuple(columns), {}
+                    columns.add(path)
+            # indexes yielded by _build_indexes are reused between iterations, so each one is consumed right away
+            columns = frozenset(columns)
+            for indexes in self._build_indexes(context, max_combinations):
+                if max_combinations is not None and emitted >= max_combinations:
+                    self._log(f'{from_input}: stopped parsing payload after {emitted} combinations of indexes',
+                              level=logging.WARNING)
+                    return
+                emitted += 1
+                yield columns, indexes
+
+    @staticmethod
+    def _walk_indexes(context, deps, indexes):
+        dep, *other_deps = deps
+        for val, inner in context.get(dep, {}).items():
+            indexes[dep] = val
+            if other_deps:
+                yield from Batch._walk_indexes(inner, other_deps, indexes)
             else:
-                yield from zip(repeat(tuple(columns)), self._build_indexes(context))
+                yield inner
+        indexes.pop(dep, None)
 
     @staticmethod
-    def _build_indexes(context):
+    def _build_indexes(context, limit=None):
+        # subtrees under sibling indexes are repeated for every combination of siblings, so they are enumerated once
+        shared, stack = [], [(context, False)]
+        while stack:
+            node, is_shared = stack.pop()
+            if is_shared:
+                shared.append(node)
+            stack.extend((inner, len(node) > 1) for values in node.values() for inner in values.values() if inner)
+        combos, budget = {}, MAX_MEMOIZED_COMBINATIONS
+        for node in reversed(shared):
+            cap = budget if limit is None else min(limit, budget)
+            memoized = tuple(islice(Batch._combine_indexes(node, combos), cap + 1))
+            if len(memoized) > cap:
+                if cap != limit:
+                    continue
+                # no more than limit combinations are emitted anyway
+                memoized = memoized[:limit]
+            combos[id(node)] = memoized
+            budget -= len(memoized)
+        indexes = {}
+        for combo in Batch._combine_indexes(context, combos):
+            indexes.clear()
+            indexes.update(combo)
+            yield indexes
+
+    @staticmethod
+    def _combine_indexes(context, combos):
         if not context:
-            yield {}
-        all_vals = []
-        all_deps = []
-        for dep, dep_ctx in context.items():
-            all_vals.append(list(dep_ctx.keys()))
-            all_deps.append(dep)
-        for combo in itertools.product(*all_vals):
-            res = dict(zip(all_deps, combo))
-            for dep, val in res.items():
-                val_ctx = context[dep][val]
-                for kv in Batch._build_indexes(val_ctx):
-                    yield {**res, **kv}
-
-    def _build_row(self, payload, cols, indexes):
-        return [
-            col.value(self._get_column_extractor(name), payload, **indexes) if name in cols
-            else None
-            for name, col in self._columns.items()
-        ]
-
-    def _write_outputs(self, selections_to_write):
+            yield ()
+            return
+        stack = [(Batch._index_steps(context), ())]
+        while stack:
+            steps, prefix = stack[-1]
+            step = next(steps, None)
+            if step is None:
+                stack.pop()
+                continue
+            head, inner = step
+            if not inner:
+                yield prefix + head
+            elif id(inner) in combos:
+                for tail in combos[id(inner)]:
+                    yield prefix + head + tail
+            else:
+                stack.append((Batch._index_steps(inner), prefix + head))
+
+    @staticmethod
+    def _index_steps(node):
+        deps = tuple(node)
+        for vals in itertools.product(*node.values()):
+            head = tuple(zip(deps, vals))
+            for dep, val in head:
+                yield head, node[dep][val]
+
+    def _row_plan(self, cols):
+        if cols not in self._row_plans:
+            by_extractor = {}
+            for i, (name, col, extractor) in enumerate(self._column_plan):
+                if name in cols:
+                    by_extractor.setdefault(id(extractor), (extractor, []))[1].append((i, name, col))
+            self._row_plans[cols] = tuple(by_extractor.values())
+        return self._row_plans[cols]
+
+    def _build_row(self, payload, cols, indexes, stats=NO_STATS):
+        row = [None] * len(self._column_plan)
+        for extractor, planned in self._row_plan(cols):
+            batched, paths = [], []
+            for i, name, col in planned:
+                try:
+                    path = col.path(**indexes)
+                except KeyError:
+                    continue
+                if path is None:
+                    started = time.perf_counter()
+                    row[i] = col.value(extractor, payload, **indexes)
+                    stats.add('column', name, 'value', time.perf_counter() - started, rows=1)
+                else:
+                    batched.append((i, name, col))
+                    paths.append(path)
+            if not paths:
+                continue
+            started = time.perf_counter()
+            values = extractor.extract_values(paths, payload)
+            stats.add('extractor', self._extractor_names[id(extractor)], 'extract', time.perf_counter() - started,
+                      rows=len(paths))
+            for (i, name, col), value in zip(batched, values):
+                started = time.perf_counter()
+                row[i] = col.from_extracted(value)
+                stats.add('column', name, 'cast', time.perf_counter() - started, rows=1)
+        return tuple(row)
+
+    def _write_outputs(self, selections_to_write, stats=NO_STATS):
         for writer_name, writer_components in self.writers.items():
             write_outputs, from_selector = writer_components['outputs'], writer_components['selector']
             cols, rows = selections_to_write[from_selector]
             if not rows:
                 continue
+            writer_started = time.perf_counter()
             for write_output in write_outputs:
+                started = time.perf_counter()
                 written_cnt = self._outputs[write_output].ingest(cols, rows)
+                stats.add('output', write_output, 'ingest', time.perf_counter() - started, rows=len(rows))
                 self._log(f'{writer_name}: written {written_cnt} records from {from_selector} into {write_output}')
             for write_output in write_outputs:
+                started = time.perf_counter()
                 self._outputs[write_output].commit()
+                stats.add('output', write_output, 'commit', time.perf_counter() - started)
+            stats.add('task', writer_name, 'write', time.perf_counter() - writer_started)
 
-    def run_forever(self, max_runs=-1, min_wait_sec=0, max_wait_sec=1):
+    def run_forever(self, max_runs=-1, min_wait_sec=0, max_wait_sec=1, callback=None):
         while True:
             if max_runs == 0:
                 break
             self.run_once()
+            if callback is not None:
+                callback(self)
             max_runs = max(max_runs - 1, -1)
             time.sleep(max(0.0, min_wait_sec + random.random() * max_wait_sec))
@@ -0,0 +1,40 @@
+import time
+
+
+class AdaptiveLimit:
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.5,
+        latency_tolerance: float = 2.0,
+        latency_slack_sec: float = 0.01,
+    ):
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff = backoff
+        self._latency_tolerance = latency_tolerance
+        self._latency_slack_sec = latency_slack_sec
+        self._limit = float(min_limit)
+        self._min_latency = None
+        self._decreased_at = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_result(self, started: float, latency_sec: float, failed: bool) -> None:
+        if self._min_latency is None or latency_sec < self._min_latency:
+            self._min_latency = latency_sec
+        # jitter of fast reads is not a sign of congestion, hence the slack
+        congested = failed or latency_sec > max(
+            self._latency_tolerance * self._min_latency, self._min_latency + self._latency_slack_sec,
+        )
+        if not congested:
+            # additive increase by one for every window of results
+            self._limit = min(float(self._max_limit), self._limit + 1 / self._limit)
+        elif started > self._decreased_at:
+            # reads that were in flight during previous decrease saw the same congestion, they are not counted twice
+            self._limit = max(float(self._min_limit), self._limit * self._backoff)
+            self._decreased_at = time.perf_counter()
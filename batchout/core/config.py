@@ -80,7 +80,9 @@ def with_config_key(
                 }
             }
         )
-        setattr(ctx, 'spec.*', getattr(ctx, 'spec.*', []) + [ctx.__name__])
+        # specs of all config mixins are collected, not only of the first base having any
+        spec_classes = [name for base in reversed(ctx.__mro__) for name in vars(base).get('spec.*', [])]
+        setattr(ctx, 'spec.*', list(dict.fromkeys(spec_classes + [ctx.__name__])))
         setattr(ctx, f'set_{key}', set_from_config)
         setattr(ctx, f'key_{key}', key)
         setattr(ctx, f'doc_{key}', doc)
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+from array import array
 from collections import defaultdict
 from datetime import datetime, date
-from typing import Collection, Any
+from itertools import islice, zip_longest
+from typing import Collection, Any, Iterable, Iterator, Union
 import sqlite3
 
 
@@ -10,12 +12,107 @@ sqlite3.register_adapter(datetime, datetime.isoformat)
 sqlite3.register_adapter(date, date.isoformat)
 
 
+SQL_TYPES = {
+    'string': 'TEXT',
+    'integer': 'INTEGER',
+    'float': 'REAL',
+    'boolean': 'BATCHOUT_BOOLEAN',
+    'date': 'BATCHOUT_DATE',
+    'datetime': 'BATCHOUT_TIMESTAMP',
+}
+
+
+def _converter(cast):
+    def convert(value: bytes) -> Any:
+        try:
+            return cast(value.decode())
+        except (TypeError, ValueError):
+            return value.decode()
+    return convert
+
+
+# only values of declared columns are converted, so aliases and aggregates are left as they are
+sqlite3.register_converter('BATCHOUT_BOOLEAN', _converter(lambda v: bool(int(v))))
+sqlite3.register_converter('BATCHOUT_DATE', _converter(date.fromisoformat))
+sqlite3.register_converter('BATCHOUT_TIMESTAMP', _converter(datetime.fromisoformat))
+
+
+class ColumnBuffer:
+
+    __slots__ = ('_kind', '_values', '_nulls', '_null_count')
+
+    TYPECODES = {
+        'integer': 'q',
+        'float': 'd',
+        'boolean': 'b',
+    }
+
+    def __init__(self, kind: str, values: Iterable[Any] = ()):
+        self._kind = kind
+        self._values = array(self.TYPECODES[kind])
+        self._nulls = bytearray()
+        self._null_count = 0
+        self.extend(values)
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    @property
+    def values(self) -> array:
+        return self._values
+
+    @property
+    def nulls(self) -> bytearray:
+        return self._nulls
+
+    @property
+    def null_count(self) -> int:
+        return self._null_count
+
+    def is_null(self, i: int) -> bool:
+        return bool(self._nulls[i >> 3] >> (i & 7) & 1)
+
+    def append(self, value: Any) -> None:
+        i = len(self._values)
+        if value is None:
+            self._values.append(0)
+        else:
+            self._values.append(value)
+        if not i & 7:
+            self._nulls.append(0)
+        if value is None:
+            self._nulls[i >> 3] |= 1 << (i & 7)
+            self._null_count += 1
+
+    def extend(self, values: Iterable[Any]) -> None:
+        for value in values:
+            self.append(value)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, i: int) -> Any:
+        value = self._values[i]
+        if self.is_null(i % len(self._values)):
+            return None
+        return bool(value) if self._kind == 'boolean' else value
+
+    def __iter__(self) -> Iterator[Any]:
+        values = map(bool, self._values) if self._kind == 'boolean' else iter(self._values)
+        if not self._null_count:
+            return values
+        return (None if self.is_null(i) else v for i, v in enumerate(values))
+
+
 class Data:
 
     def __init__(self, *columns: str, **types: str):
         self._columns = columns
         self._types = {c: types.get(c, 'string') for c in columns}
         self._sources = list()
+        self._tables = set()
+        self._buffers = dict()
         self._len = 0
         self._len_per_source = defaultdict(int)
         self._db = None
@@ -25,6 +122,10 @@ class Data:
     def columns(self) -> list[str]:
         return list(self._columns)
 
+    @property
+    def _declared_columns(self) -> list[str]:
+        return [f'{c} {SQL_TYPES[self._types[c]]}' if self._types[c] in SQL_TYPES else c for c in self._columns]
+
     @property
     def sources(self) -> list[str]:
         return list(self._sources)
@@ -32,17 +133,41 @@ class Data:
     @property
     def cursor(self) -> sqlite3.Cursor:
         if not self._db:
-            self._db = sqlite3.connect(':memory:')
+            self._db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
         if not self._cursor:
             self._cursor = self._db.cursor()
+        self._flush()
         return self._cursor
 
+    def _new_buffers(self) -> list[Union[ColumnBuffer, list]]:
+        return [
+            ColumnBuffer(self._types[c]) if self._types[c] in ColumnBuffer.TYPECODES else []
+            for c in self._columns
+        ]
+
+    def _flush(self) -> None:
+        for source in self._sources:
+            if source not in self._tables:
+                self._cursor.execute(f"CREATE TABLE {source}({','.join(self._declared_columns)})")
+                self._tables.add(source)
+            buffers = self._buffers[source]
+            if not buffers or not len(buffers[0]):
+                continue
+            __values = ','.join(['?'] * len(self._columns))
+            __columns = ','.join(self._columns)
+            self._cursor.executemany(f"INSERT INTO {source}({__columns}) VALUES ({__values})", zip(*buffers))
+            self._buffers[source] = self._new_buffers()
+
     def reset(self) -> Data:
-        self._cursor.close()
+        if self._cursor:
+            self._cursor.close()
         self._cursor = None
-        self._db.close()
+        if self._db:
+            self._db.close()
         self._db = None
         self._sources = list()
+        self._tables = set()
+        self._buffers = dict()
         self._len = 0
         self._len_per_source = defaultdict(int)
         return self
@@ -50,7 +175,7 @@ class Data:
     def with_sources(self, *sources: str) -> Data:
         for source in sources:
             if source not in self._sources:
-                self.cursor.execute(f"CREATE TABLE {source}({','.join(self._columns)})")
+                self._buffers[source] = self._new_buffers()
                 self._sources.append(source)
         return self
 
@@ -59,35 +184,55 @@ class Data:
         if not rows:
             return self
 
-        __values = ','.join(['?'] * len(self._columns))
-        __columns = ','.join(self._columns)
+        buffers = self._buffers[source]
+        width = len(self._columns)
+        for row in rows:
+            for i, value in zip_longest(range(width), tuple(row)[:width]):
+                try:
+                    buffers[i].append(value)
+                except (TypeError, OverflowError):
+                    buffers[i] = [*buffers[i], value]
+        self._len += len(rows)
+        self._len_per_source[source] += len(rows)
+        return self
 
-        self.cursor.executemany(
-            f"INSERT INTO {source}({__columns}) VALUES ({__values})",
-            (tuple(row)[:len(self._columns)] for row in rows)
-        )
-        self._len += self.cursor.rowcount
-        self._len_per_source[source] += self.cursor.rowcount
+    def with_data(self, data: Data, *sources: str) -> Data:
+        for source in sources or data.sources:
+            self.with_sources(source)
+            if source not in data.sources:
+                continue
+            if source in data._tables:
+                self.with_row(source, *data.rows(source))
+                continue
+            size = data.count(source)
+            buffers = self._buffers[source]
+            for i, values in enumerate(data._buffers[source]):
+                known_size = len(buffers[i])
+                try:
+                    buffers[i].extend(values)
+                except (TypeError, OverflowError):
+                    buffers[i] = [*islice(buffers[i], known_size), *values]
+            self._len += size
+            self._len_per_source[source] += size
         return self
 
+    def buffers(self, source: str) -> dict[str, Union[ColumnBuffer, list]]:
+        if source not in self._sources:
+            return {}
+        if source not in self._tables:
+            return dict(zip(self._columns, self._buffers[source]))
+        buffers = self._new_buffers()
+        for row in self.cursor.execute(f"SELECT {','.join(self.columns)} FROM {source}"):
+            for buffer, value in zip(buffers, row):
+                buffer.append(value)
+        return dict(zip(self._columns, buffers))
+
     def rows(self, source: str) -> list[list[Any]]:
         if source not in self._sources:
             return []
-        return list(map(
-            self._with_typecasts,
-            self.cursor.execute(f"SELECT {','.join(self.columns)} FROM {source}")
-        ))
-
-    def _with_typecasts(self, row: Collection[Any]) -> list[Any]:
-        typed_row = list(row)
-        for col, val, i in zip(self._columns, row, range(len(self._columns))):
-            if self._types.get(col) == 'datetime':
-                typed_row[i] = datetime.fromisoformat(val) if val else None
-            elif self._types.get(col) == 'date':
-                typed_row[i] = datetime.fromisoformat(val) if val else None
-            elif self._types.get(col) == 'boolean':
-                typed_row[i] = bool(val)
-        return typed_row
+        if source not in self._tables:
+            return list(map(list, zip(*self._buffers[source])))
+        return list(map(list, self.cursor.execute(f"SELECT {','.join(self.columns)} FROM {source}")))
 
     def __len__(self) -> int:
         return self._len
@@ -96,7 +241,7 @@ class Data:
         return sum([self._len_per_source[src] for src in sources])
 
     def clone(self) -> Data:
-        cloned = Data(*self.columns)
+        cloned = Data(*self.columns, **self._types)
         for source in self.sources:
             cloned.with_row(source, *self.rows(source))
         return cloned
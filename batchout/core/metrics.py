@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class MetricTypeMismatch(Exception):
+    pass
+
+
+def _labels(labels: tuple[tuple[str, str], ...], **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._types: dict[str, str] = {}
+        self._help: dict[str, str] = {}
+        self._values: dict[str, dict[tuple, list]] = {}
+
+    def _series(self, kind: str, metric: str, help_: str, labels: dict[str, str], initial) -> list:
+        if self._types.setdefault(metric, kind) != kind:
+            raise MetricTypeMismatch(f'{metric} is a {self._types[metric]}, not a {kind}')
+        if help_:
+            self._help.setdefault(metric, help_)
+        series = self._values.setdefault(metric, {})
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        if key not in series:
+            series[key] = initial()
+        return series[key]
+
+    def inc(self, metric: str, value: float = 1, help_: str = '', **labels: str) -> None:
+        with self._lock:
+            self._series('counter', metric, help_, labels, lambda: [0])[0] += value
+
+    def set(self, metric: str, value: float, help_: str = '', **labels: str) -> None:
+        with self._lock:
+            self._series('gauge', metric, help_, labels, lambda: [0])[0] = value
+
+    def observe(self, metric: str, value: float, help_: str = '', **labels: str) -> None:
+        with self._lock:
+            # per bucket counts followed by count and sum of all observations
+            series = self._series('histogram', metric, help_, labels, lambda: [0] * (len(self._buckets) + 2) + [0.0])
+            series[bisect_left(self._buckets, value)] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def get(self, metric: str, **labels: str) -> Optional[float]:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._values.get(metric, {}).get(key)
+            if series is None:
+                return None
+            return series[-2] if self._types[metric] == 'histogram' else series[0]
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in self._values.items():
+                kind = self._types[name]
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, values in series.items():
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_labels(labels)} {_number(values[0])}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*self._buckets, float('inf')), values):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}')
+                    lines.append(f'{name}_count{_labels(labels)} {values[-2]}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(values[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+def write_textfile(metrics: Metrics, path: str) -> None:
+    # node_exporter may read the file at any moment, so it is replaced atomically
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.batchout-metrics-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(metrics.render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class MetricsServer:
+
+    def __init__(self, metrics: Metrics, port: int, host: str = ''):
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> 'MetricsServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='batchout-metrics', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
@@ -0,0 +1,85 @@
+import cProfile
+import os.path
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+
+class CProfiler:
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+
+    def clear(self) -> None:
+        self._profile.clear()
+
+    def dump(self, path: str) -> None:
+        self._profile.dump_stats(path)
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_sec: float = 0.005):
+        self._interval_sec = interval_sec
+        self._stacks = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self._stacks[';'.join(reversed(stack))] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval_sec):
+            self._sample()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='batchout-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def clear(self) -> None:
+        self._stacks.clear()
+
+    def collapsed(self) -> list[str]:
+        return [f'{stack} {count}' for stack, count in self._stacks.most_common()]
+
+    def dump(self, path: str) -> None:
+        with open(path, mode='w') as f:
+            f.writelines(line + '\n' for line in self.collapsed())
+
+
+PROFILERS = {
+    'cprofile': CProfiler,
+    'sampling': SamplingProfiler,
+}
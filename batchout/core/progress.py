@@ -0,0 +1,41 @@
+import time
+from typing import Optional
+
+
+class Progress:
+
+    def __init__(self, total: int, interval_sec: float):
+        self._total = total
+        self._interval_sec = interval_sec
+        self._started = self._reported = time.perf_counter()
+        self.done = 0
+        self.errors = 0
+        self.rows = 0
+
+    def update(self, rows: int = 0, errors: int = 0) -> bool:
+        self.done += 1
+        self.rows += rows
+        self.errors += errors
+        now = time.perf_counter()
+        if self.done < self._total and now - self._reported < self._interval_sec:
+            return False
+        self._reported = now
+        return True
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self._started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_sec(self) -> Optional[float]:
+        rate = self.rate
+        return (self._total - self.done) / rate if rate > 0 else None
+
+    def line(self) -> str:
+        eta = self.eta_sec
+        return (
+            f'{self.done}/{self._total} reads ({self.done / max(self._total, 1):.0%}), '
+            f'{self.rate:.1f} reads/s, {self.rows} records, {self.errors} errors, '
+            f'ETA {"?" if eta is None else f"{eta:.0f}s"}'
+        )
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+
+class Stats:
+
+    FIELDS = ('calls', 'seconds', 'rows', 'bytes')
+
+    def __init__(self):
+        self._started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._seconds: Optional[float] = None
+        self._entries: dict[tuple[str, str, str], list] = {}
+
+    @property
+    def started_at(self) -> datetime:
+        return self._started_at
+
+    @property
+    def seconds(self) -> float:
+        if self._seconds is None:
+            return time.perf_counter() - self._started
+        return self._seconds
+
+    def add(
+        self,
+        role: str,
+        name: str,
+        stage: str,
+        seconds: float = 0.0,
+        calls: int = 1,
+        rows: int = 0,
+        size: int = 0,
+    ) -> Stats:
+        entry = self._entries.get((role, name, stage))
+        if entry is None:
+            entry = self._entries[(role, name, stage)] = [0, 0.0, 0, 0]
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += rows
+        entry[3] += size
+        return self
+
+    def merge(self, other: Stats) -> Stats:
+        for (role, name, stage), (calls, seconds, rows, size) in other._entries.items():
+            self.add(role, name, stage, seconds, calls, rows, size)
+        return self
+
+    def finish(self) -> Stats:
+        self._seconds = time.perf_counter() - self._started
+        return self
+
+    def get(self, role: str, name: str, stage: str) -> dict[str, Any]:
+        return dict(zip(self.FIELDS, self._entries.get((role, name, stage), (0, 0.0, 0, 0))))
+
+    def entries(self) -> list[dict[str, Any]]:
+        return [
+            {'role': role, 'name': name, 'stage': stage, **dict(zip(self.FIELDS, entry))}
+            for (role, name, stage), entry in self._entries.items()
+        ]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'started_at': self._started_at.isoformat(),
+            'seconds': self.seconds,
+            'components': self.entries(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+
+class NoStats(Stats):
+
+    def add(self, *_, **__) -> Stats:
+        return self
+
+    def merge(self, other: Stats) -> Stats:
+        return self
+
+    def finish(self) -> Stats:
+        return self
+
+
+NO_STATS = NoStats()
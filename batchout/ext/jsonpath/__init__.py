@@ -3,4 +3,4 @@ try:
 except ImportError:
     pass
 else:
-    from .extractors import JsonpathExtractor
+    from .extractors import JsonpathExtractor, FastJsonpathExtractor
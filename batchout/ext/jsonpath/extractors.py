@@ -1,13 +1,15 @@
+import re
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Sequence
 
 from jsonpath_rw import parse
+from jsonpath_rw.jsonpath import Root, Fields, Index
 
 from ...core.config import with_config_key
 from ...core.registry import Registry
 from ...std import Extractor
-from ...std.extractors.mixin import WithStrategy
+from ...std.extractors.mixin import WithStrategy, WithPayloadCache
 
 
 log = logging.getLogger(__name__)
@@ -18,6 +20,63 @@ with_jsonpath_strategy = with_config_key(
     choices=('take_first', 'take_first_not_null', 'take_last', 'take_last_not_null'),
 )
 
+_first_step = re.compile(r'(?P<root>\$)|(?P<field>[a-zA-Z_][a-zA-Z0-9_@\-]*)|\[(?P<index>\d+)]')
+_next_step = re.compile(r'\.(?P<field>[a-zA-Z_][a-zA-Z0-9_@\-]*)|\.?\[(?P<index>\d+)]')
+
+
+def _split_steps(path: str) -> Optional[list[tuple[int, Any]]]:
+    steps = []
+    pos = 0
+    step_re = _first_step
+    while pos < len(path):
+        m = step_re.match(path, pos)
+        if m is None:
+            return None
+        if m.group('index') is not None:
+            step = Index(int(m.group('index')))
+        elif m.group('field') is not None:
+            if m.group('field') == 'where':
+                return None
+            step = Fields(m.group('field'))
+        else:
+            step = Root()
+        pos = m.end()
+        steps.append((pos, step))
+        step_re = _next_step
+    return steps or None
+
+
+def _compile_keys(path: str) -> Optional[tuple[str, tuple]]:
+    steps = _split_steps(path)
+    if steps is None:
+        return None
+    keys = tuple(
+        step.fields[0] if isinstance(step, Fields) else step.index
+        for _, step in steps if not isinstance(step, Root)
+    )
+    # same as str(datum.full_path) given by jsonpath_rw
+    full_path = '.'.join(key if isinstance(key, str) else f'[{key}]' for key in keys) or '$'
+    return full_path, keys
+
+
+def _full_path(datum) -> str:
+    return str(datum.full_path)
+
+
+def _lookup(document: Any, keys: tuple) -> tuple:
+    value = document
+    for key in keys:
+        if isinstance(key, int):
+            if len(value) <= key:
+                return ()
+            value = value[key]
+        else:
+            try:
+                value = value[key]
+            except (TypeError, KeyError, AttributeError):
+                return ()
+    return (value,)
+
 
 class JsonpathExtractorConfigInvalid(Exception):
     pass
@@ -25,24 +84,95 @@ class JsonpathExtractorConfigInvalid(Exception):
 
 @with_jsonpath_strategy
 @Registry.bind(Extractor, 'jsonpath')
-class JsonpathExtractor(Extractor, WithStrategy):
+class JsonpathExtractor(WithStrategy, WithPayloadCache, Extractor):
 
     def __init__(self, config: Dict[str, Any]):
         self._parsers = {}
+        self._steps = {}
+        self._init_payload_cache()
         self.set_strategy(config)
         if self._strategy not in self.strategy_choices:
             raise JsonpathExtractorConfigInvalid('strategy must be one of %s', self.strategy_choices)
 
     def _prepare(self, path: str):
-        if path not in self._parsers:
+        if path not in self._steps:
+            self._steps[path] = _split_steps(path)
+        if self._steps[path] is None and path not in self._parsers:
             self._parsers[path] = parse(path)
 
+    def _document(self, payload: bytes) -> dict[str, Any]:
+        cached = self._cache_for(payload)
+        if 'document' not in cached:
+            cached['document'] = json.loads(payload)
+            cached['nodes'] = {}
+        return cached
+
+    def _find(self, path: str, payload: bytes) -> list:
+        cached = self._document(payload)
+        document, nodes = cached['document'], cached['nodes']
+        steps = self._steps[path]
+        if steps is None:
+            return self._parsers[path].find(document)
+        # continue from the longest prefix already resolved for this payload, e.g. by a parent index
+        start, datums = 0, [document]
+        for i in range(len(steps) - 1, -1, -1):
+            prefix = path[:steps[i][0]]
+            if prefix in nodes:
+                start, datums = i + 1, nodes[prefix]
+                break
+        for end, step in steps[start:]:
+            datums = [match for datum in datums for match in step.find(datum)]
+            nodes[path[:end]] = datums
+        return datums
+
     def extract(self, path: str, payload: bytes) -> tuple[Optional[str], Optional[Any]]:
-        self._prepare(path)
-        try:
-            payload = json.loads(payload)
-            datums = self._parsers[path].find(payload)
-            return self._apply_strategy((str(datum.full_path), datum.value) for datum in datums)
-        except Exception as exc:
-            log.error('Failed to extract "%s" from JSON: %s', path, exc)
-            return None, None
+        return self.extract_many((path,), payload)[0]
+
+    def extract_many(self, paths: Sequence[str], payload: bytes) -> list[tuple[Optional[str], Optional[Any]]]:
+        return self._extract_many(paths, payload, with_paths=True)
+
+    def extract_value(self, path: str, payload: bytes) -> Optional[Any]:
+        return self.extract_values((path,), payload)[0]
+
+    def extract_values(self, paths: Sequence[str], payload: bytes) -> list[Optional[Any]]:
+        return [value for _, value in self._extract_many(paths, payload, with_paths=False)]
+
+    def _extract_many(self, paths: Sequence[str], payload: bytes, with_paths: bool) -> list[tuple[Any, Optional[Any]]]:
+        results = []
+        for path in paths:
+            self._prepare(path)
+            try:
+                datums = self._find(path, payload)
+                results.append(self._apply_strategy(
+                    ((datum, datum.value) for datum in datums),
+                    _full_path if with_paths else None,
+                ))
+            except Exception as exc:
+                log.error('Failed to extract "%s" from JSON: %s', path, exc)
+                results.append((None, None))
+        return results
+
+
+@Registry.bind(Extractor, 'jsonpath_fast')
+class FastJsonpathExtractor(JsonpathExtractor):
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self._compiled = {}
+
+    def _extract_many(self, paths: Sequence[str], payload: bytes, with_paths: bool) -> list[tuple[Any, Optional[Any]]]:
+        results = []
+        for path in paths:
+            if path not in self._compiled:
+                self._compiled[path] = _compile_keys(path)
+            if self._compiled[path] is None:
+                results.extend(super()._extract_many((path,), payload, with_paths))
+                continue
+            full_path, keys = self._compiled[path]
+            try:
+                found = _lookup(self._document(payload)['document'], keys)
+                results.append(self._apply_strategy((full_path, value) for value in found))
+            except Exception as exc:
+                log.error('Failed to extract "%s" from JSON: %s', path, exc)
+                results.append((None, None))
+        return results
@@ -1,13 +1,12 @@
 import logging
-from typing import Dict, Any
-from functools import lru_cache
+from typing import Dict, Any, Sequence
 
 from lxml import etree
 
 from ...core.config import with_config_key
 from ...core.registry import Registry
 from ...std import Extractor
-from ...std.extractors.mixin import WithStrategy
+from ...std.extractors.mixin import WithStrategy, WithPayloadCache
 
 
 log = logging.getLogger(__name__)
@@ -24,36 +23,66 @@ class XPathExtractorConfigInvalid(Exception):
 
 
 @with_config_key('html', default=False, choices=(True, False))
+@with_config_key(
+    'cache_max_bytes',
+    doc='Parsed documents are cached until their payloads reach this size in total, 0 for no limit',
+    default=256 * 1024 * 1024,
+)
 @with_xpath_strategy
 @Registry.bind(Extractor, 'xpath')
-class XPathExtractor(Extractor, WithStrategy):
+class XPathExtractor(WithStrategy, WithPayloadCache, Extractor):
 
     first_index = 1
 
     def __init__(self, config: Dict[str, Any]):
         self._parsers = {}
-        self._root = None
         self.set_strategy(config)
         if self._strategy not in self.strategy_choices:
-            raise XPathExtractorConfigInvalid('strategy must be one of %s', self.xpath_strategies)
+            raise XPathExtractorConfigInvalid('strategy must be one of %s', self.strategy_choices)
         self.set_html(config)
+        self.set_cache_max_bytes(config)
+        if not isinstance(self._cache_max_bytes, int) or self._cache_max_bytes < 0:
+            raise XPathExtractorConfigInvalid('cache_max_bytes must be a non-negative integer')
+        self._init_payload_cache(self._cache_max_bytes)
 
-    @lru_cache(maxsize=32)
     def _get_root(self, payload):
-        if self._html:
-            return etree.HTML(payload.decode('utf8'))
-        else:
-            return etree.fromstring(payload.decode('utf8'))
-
-    def _prepare(self, path: str, payload: bytes):
+        cached = self._cache_for(payload)
+        if 'root' not in cached:
+            if self._html:
+                cached['root'] = etree.HTML(payload.decode('utf8'))
+            else:
+                cached['root'] = etree.fromstring(payload.decode('utf8'))
+        return cached['root']
+
+    def _prepare(self, path: str):
         if path not in self._parsers:
             self._parsers[path] = etree.XPath(path)
-        self._root = self._get_root(payload)
 
     def extract(self, path: str, payload: bytes):
+        return self.extract_many((path,), payload)[0]
+
+    def extract_many(self, paths: Sequence[str], payload: bytes):
+        return self._extract_many(paths, payload, with_paths=True)
+
+    def extract_value(self, path: str, payload: bytes):
+        return self.extract_values((path,), payload)[0]
+
+    def extract_values(self, paths: Sequence[str], payload: bytes):
+        return [value for _, value in self._extract_many(paths, payload, with_paths=False)]
+
+    def _extract_many(self, paths, payload, with_paths):
         try:
-            self._prepare(path, payload)
-            results = self._parsers[path](self._root)
+            root = self._get_root(payload)
+        except Exception as e:
+            for path in paths:
+                log.error('Failed to extract "%s" from XML: %s', path, e)
+            return [(None, None)] * len(paths)
+        return [self._extract_from(path, root, with_paths) for path in paths]
+
+    def _extract_from(self, path, root, with_paths):
+        try:
+            self._prepare(path)
+            results = self._parsers[path](root)
         except Exception as e:
             log.error('Failed to extract "%s" from XML: %s', path, e)
             return None, None
@@ -61,9 +90,9 @@ class XPathExtractor(Extractor, WithStrategy):
         if not isinstance(results, list):
             results = [results]
 
-        return self._apply_strategy(
-            (self._root.getpath(res), res)
-            if (etree.iselement(res) and hasattr(self._root, 'getpath'))
-            else (path, res)
-            for res in results
-        )
+        def path_of(res):
+            if etree.iselement(res) and hasattr(root, 'getpath'):
+                return root.getpath(res)
+            return path
+
+        return self._apply_strategy(((res, res) for res in results), path_of if with_paths else None)
@@ -1,4 +1,5 @@
 import abc
+from typing import Any, Optional
 
 from ..extractors import Extractor
 
@@ -9,3 +10,9 @@ class Column:
     @abc.abstractmethod
     def value(self, extractor: Extractor, payload: bytes, **indexes: str):
         raise NotImplementedError
+
+    def path(self, **indexes: str) -> Optional[str]:
+        return None
+
+    def from_extracted(self, value: Any):
+        raise NotImplementedError
@@ -27,9 +27,18 @@ class ScalarColumn(Column, WithProcessors):
 
     def value(self, extractor, payload, **indexes):
         try:
-            _, v = extractor.extract(self._path.format(**indexes), payload)
+            path = self._path.format(**indexes)
         except KeyError:
-            v = None
+            return
+        return self.from_extracted(extractor.extract_value(path, payload))
+
+    def path(self, **indexes):
+        if type(self).value is not ScalarColumn.value:
+            # subclass extracts on its own, so value() is called for each row
+            return None
+        return self._path.format(**indexes)
+
+    def from_extracted(self, v):
         if v is None:
             return
         try:
@@ -1,5 +1,5 @@
 import abc
-from typing import Optional, Any
+from typing import Optional, Any, Sequence
 
 
 class Extractor:
@@ -10,3 +10,15 @@ class Extractor:
     @abc.abstractmethod
     def extract(self, path: str, payload: bytes) -> tuple[Optional[str], Optional[Any]]:
         raise NotImplementedError
+
+    def extract_many(self, paths: Sequence[str], payload: bytes) -> list[tuple[Optional[str], Optional[Any]]]:
+        return [self.extract(path, payload) for path in paths]
+
+    def extract_value(self, path: str, payload: bytes) -> Optional[Any]:
+        return self.extract(path, payload)[1]
+
+    def extract_values(self, paths: Sequence[str], payload: bytes) -> list[Optional[Any]]:
+        return [value for _, value in self.extract_many(paths, payload)]
+
+    def release(self, payload: bytes) -> None:
+        pass
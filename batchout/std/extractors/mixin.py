@@ -1,4 +1,6 @@
-from typing import Any, Iterable
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Iterable, Optional
 
 from ...core.config import with_config_key
 
@@ -21,18 +23,24 @@ with_strategy = with_config_key(
 @with_strategy
 class WithStrategy(object):
 
-    def _apply_strategy(self, results: Iterable[tuple[str, Any]]) -> tuple[str, Any]:
+    def _apply_strategy(
+        self,
+        results: Iterable[tuple[Any, Any]],
+        path_of: Optional[Callable[[Any], str]] = None,
+    ) -> tuple[Any, Any]:
         if not hasattr(self, '_strategy'):
             raise StrategyNotSet
 
         p, v = None, None
         if self._strategy == self.strategy_take_first:
             for path, value in results:
-                return path, value
+                p, v = path, value
+                break
         elif self._strategy == self.strategy_take_first_not_null:
             for path, value in results:
                 if value is not None:
-                    return path, value
+                    p, v = path, value
+                    break
         elif self._strategy == self.strategy_take_last:
             for path, value in results:
                 p, v = path, value
@@ -44,4 +52,46 @@ class WithStrategy(object):
             p, v = tuple(zip(*results)) or (None, None)
         else:
             raise UnknownStrategy(self._strategy)
+        # paths are built only for the matches kept by strategy
+        if path_of is not None and p is not None:
+            p = tuple(map(path_of, p)) if self._strategy == self.strategy_take_all else path_of(p)
         return p, v
+
+
+class WithPayloadCache(object):
+
+    payload_cache_size = 32
+
+    def _init_payload_cache(self, max_bytes: Optional[int] = None):
+        self._payload_cache: OrderedDict[int, tuple[bytes, dict[str, Any]]] = OrderedDict()
+        self._payload_cache_lock = Lock()
+        self._payload_cache_bytes = 0
+        self._payload_cache_max_bytes = max_bytes
+
+    def _evict_payloads(self):
+        while len(self._payload_cache) > 1 and (
+            len(self._payload_cache) > self.payload_cache_size
+            or (self._payload_cache_max_bytes and self._payload_cache_bytes > self._payload_cache_max_bytes)
+        ):
+            _, (payload, _) = self._payload_cache.popitem(last=False)
+            self._payload_cache_bytes -= len(payload)
+
+    def _cache_for(self, payload: bytes) -> dict[str, Any]:
+        key = id(payload)
+        with self._payload_cache_lock:
+            # cache holds a reference to the payload, so its id is not reused while it is cached
+            cached = self._payload_cache.get(key)
+            if cached is None:
+                cached = self._payload_cache[key] = (payload, {})
+                self._payload_cache_bytes += len(payload)
+                self._evict_payloads()
+            else:
+                self._payload_cache.move_to_end(key)
+        return cached[1]
+
+    def release(self, payload: bytes) -> None:
+        key = id(payload)
+        with self._payload_cache_lock:
+            cached = self._payload_cache.pop(key, None)
+            if cached is not None:
+                self._payload_cache_bytes -= len(cached[0])
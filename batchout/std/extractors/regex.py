@@ -2,12 +2,12 @@ import re
 import logging
 from operator import or_
 from functools import reduce
-from typing import Any, Optional
+from typing import Any, Optional, Sequence
 
 from ...core.config import with_config_key
 from ...core.registry import Registry
 from .base import Extractor
-from .mixin import WithStrategy
+from .mixin import WithStrategy, WithPayloadCache
 
 
 log = logging.getLogger(__name__)
@@ -34,15 +34,22 @@ with_regex_strategy = with_config_key(
 
 
 @with_config_key('encoding', default='utf8')
-@with_config_key('decode_bytes', doc='Decode bytes to string before using regex', default=True, choices=(True, False))
+@with_config_key(
+    'decode_bytes',
+    doc='Decode bytes to string before using regex, '
+        '`false` matches patterns against raw bytes and decodes only matches',
+    default=True,
+    choices=(True, False),
+)
 @with_config_key('flags', doc='Regex flags supported by Python', default_factory=list)
 @with_config_key('group', doc='Capture group to extract from, starting from 0 (whole match)', default=0)
 @with_regex_strategy
 @Registry.bind(Extractor, 'regex')
-class RegexExtractor(Extractor, WithStrategy):
+class RegexExtractor(WithStrategy, WithPayloadCache, Extractor):
 
     def __init__(self, config: dict[str, Any]):
         self._parsers: dict[str, re.Pattern] = {}
+        self._init_payload_cache()
         self.set_strategy(config)
         if self._strategy not in self.strategy_choices:
             raise RegexExtractorConfigInvalid('strategy must be one of %s', self.strategy_choices)
@@ -55,24 +62,47 @@ class RegexExtractor(Extractor, WithStrategy):
         if len(_exc_flags.intersection(self._re_flags)) > 1:
             raise RegexExtractorConfigInvalid('these flags are mutually exclusive, choose one: %s', _exc_flag_names)
         self.set_decode_bytes(config)
+        if not self._decode_bytes and re.RegexFlag.UNICODE in self._re_flags:
+            raise RegexExtractorConfigInvalid('flag %s requires decode_bytes', _fmt_flag(re.RegexFlag.UNICODE))
         self.set_encoding(config)
         self.set_group(config)
         self._group = int(self._group)
 
     def _prepare(self, path: str):
         if path not in self._parsers:
-            self._parsers[path] = re.compile(path, reduce(or_, self._re_flags))
+            pattern = path if self._decode_bytes else path.encode(self._encoding)
+            self._parsers[path] = re.compile(pattern, reduce(or_, self._re_flags, 0))
+
+    def _text(self, payload: bytes) -> str:
+        cached = self._cache_for(payload)
+        if 'text' not in cached:
+            cached['text'] = payload.decode(self._encoding)
+        return cached['text']
+
+    def _group_of(self, match: re.Match) -> Optional[str]:
+        value = match.group(self._group)
+        if isinstance(value, bytes):
+            return value.decode(self._encoding)
+        return value
 
     def extract(self, path: str, payload: bytes) -> tuple[Optional[str], Optional[Any]]:
+        return self.extract_many((path,), payload)[0]
+
+    def extract_many(self, paths: Sequence[str], payload: bytes) -> list[tuple[Optional[str], Optional[Any]]]:
         try:
             if self._decode_bytes:
-                payload = payload.decode(self._encoding)
+                payload = self._text(payload)
         except Exception as exc:
             log.error('Failed to decode payload from %s: %s', self._encoding, exc)
-            return None, None
-        self._prepare(path)
-        try:
-            return self._apply_strategy((path, m.group(self._group)) for m in self._parsers[path].finditer(payload))
-        except Exception as exc:
-            log.error('Failed searching "%s" in payload: %s', path, exc)
-            return None, None
+            return [(None, None)] * len(paths)
+        results = []
+        for path in paths:
+            self._prepare(path)
+            try:
+                results.append(self._apply_strategy(
+                    (path, self._group_of(m)) for m in self._parsers[path].finditer(payload)
+                ))
+            except Exception as exc:
+                log.error('Failed searching "%s" in payload: %s', path, exc)
+                results.append((None, None))
+        return results
@@ -26,7 +26,7 @@ class ScalarIndex(Index):
 class IndexForList(ScalarIndex):
 
     def values(self, extractor, payload, **parent_indexes):
-        _, li = extractor.extract(self._path.format(**parent_indexes), payload)
+        li = extractor.extract_value(self._path.format(**parent_indexes), payload)
         if not isinstance(li, (str, bytes)) and isinstance(li, Sized):
             return list(range(extractor.first_index, len(li) + extractor.first_index))
         return []
@@ -36,7 +36,7 @@ class IndexForList(ScalarIndex):
 class IndexForObject(ScalarIndex):
 
     def values(self, extractor, payload, **parent_indexes):
-        _, ob = extractor.extract(self._path.format(**parent_indexes), payload)
+        ob = extractor.extract_value(self._path.format(**parent_indexes), payload)
         if isinstance(ob, Mapping):
             return list(ob.keys())
         return []
@@ -46,7 +46,7 @@ class IndexForObject(ScalarIndex):
 class IndexFromList(ScalarIndex):
 
     def values(self, extractor, payload, **parent_indexes):
-        _, li = extractor.extract(self._path.format(**parent_indexes), payload)
+        li = extractor.extract_value(self._path.format(**parent_indexes), payload)
         if not isinstance(li, (str, bytes)) and isinstance(li, Iterable):
             return list(li)
         return []
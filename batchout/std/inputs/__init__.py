@@ -1,4 +1,4 @@
-from .base import Input
+from .base import Input, FetchRetryable
 from .const import ConstInput
 from .http import HttpInput
 from .file import FileInput
@@ -1,5 +1,22 @@
 import abc
-from typing import Any
+from typing import Any, Optional
+
+
+class FetchRetryable(Exception):
+
+    def __init__(
+        self,
+        message: str,
+        retries: int = 3,
+        max_backoff_sec: float = 60,
+        retry_after_sec: Optional[float] = None,
+        throttled: bool = False,
+    ):
+        super().__init__(message)
+        self.retries = retries
+        self.max_backoff_sec = max_backoff_sec
+        self.retry_after_sec = retry_after_sec
+        self.throttled = throttled
 
 
 class Input:
@@ -16,3 +33,21 @@ class Input:
     @abc.abstractmethod
     def reset(self) -> None:
         raise NotImplementedError
+
+    def counters(self) -> dict[str, int]:
+        return {}
+
+    def content_hashes(self):
+        return None
+
+    def share_batch_state(self, state: dict) -> None:
+        pass
+
+    def share_state(self, master: 'Input') -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def reserve_read(self) -> float:
+        return 0.0
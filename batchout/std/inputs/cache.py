@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Optional
+
+
+class ResponseCacheWriter(object):
+
+    def __init__(self, cache: 'ResponseCache', key: str, meta: dict):
+        self._cache = cache
+        self._key = key
+        self._meta = meta
+        fd, self._tmp_path = tempfile.mkstemp(dir=cache.path, prefix='.tmp-')
+        self._file = os.fdopen(fd, mode='wb')
+        self._complete = False
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def complete(self) -> bool:
+        return self._complete
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def finish(self) -> None:
+        # body is complete, but it is published only when batch commits
+        self._file.close()
+        self._complete = True
+
+    def publish(self) -> None:
+        if not self._complete:
+            return self.abort()
+        # body goes first, so that meta never points to a body that is not there yet
+        os.replace(self._tmp_path, self._cache.body_path(self._key))
+        self._cache.write_meta(self._key, self._meta)
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ResponseCache(object):
+
+    def __init__(self, path: str, ttl_sec: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.path = path
+        self._ttl_sec = ttl_sec
+        self._max_bytes = max_bytes
+        self._staged = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return hashlib.sha256('\n'.join(parts).encode('utf8')).hexdigest()
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.body')
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.json')
+
+    def write_meta(self, key: str, meta: dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+        with os.fdopen(fd, mode='w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path(key))
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self.body_path(key)):
+            return None
+        return meta
+
+    def is_fresh(self, meta: dict) -> bool:
+        return self._ttl_sec is not None and time.time() - meta['stored_at'] < self._ttl_sec
+
+    def refresh(self, key: str, meta: dict) -> None:
+        self.write_meta(key, {**meta, 'stored_at': time.time()})
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        try:
+            body = open(self.body_path(key), mode='rb')
+        except FileNotFoundError:
+            return None
+        # access time is tracked explicitly as file systems are often mounted with noatime
+        os.utime(body.fileno())
+        return body
+
+    def writer(self, key: str, **meta) -> ResponseCacheWriter:
+        return ResponseCacheWriter(self, key, {**meta, 'stored_at': time.time()})
+
+    def stage(self, *writers: ResponseCacheWriter) -> None:
+        with self._lock:
+            for writer in writers:
+                if not writer.complete:
+                    writer.abort()
+                    continue
+                replaced = self._staged.pop(writer.key, None)
+                if replaced is not None:
+                    replaced.abort()
+                self._staged[writer.key] = writer
+
+    def commit(self) -> None:
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        for writer in staged.values():
+            writer.publish()
+        if staged:
+            self.evict()
+
+    def rollback(self) -> None:
+        with self._lock:
+            staged, self._staged = self._staged, {}
+        for writer in staged.values():
+            writer.abort()
+
+    def evict(self) -> None:
+        if not self._max_bytes:
+            return
+        bodies = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.body'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                bodies.append((stat.st_mtime, stat.st_size, entry.name[:-len('.body')]))
+        total = sum(size for _, size, _ in bodies)
+        for _, size, key in sorted(bodies):
+            if total <= self._max_bytes:
+                break
+            for path in (self._meta_path(key), self.body_path(key)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+
+class CachingReader(object):
+
+    def __init__(self, stream: BinaryIO, writer: ResponseCacheWriter):
+        self._stream = stream
+        self._writer = writer
+
+    @property
+    def closed(self) -> bool:
+        return self._stream.closed
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        if data:
+            self._writer.write(data)
+        elif not self._writer.complete:
+            self._writer.finish()
+        return data
+
+    def close(self) -> None:
+        # a body that was not read to the end is not cached
+        if not self._writer.complete:
+            self._writer.abort()
+        self._stream.close()
@@ -1,14 +1,20 @@
 import logging
-import time
+import threading
+import zlib
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from http.client import HTTPConnection, HTTPSConnection
+from functools import partial
+from http.client import HTTPConnection, HTTPResponse, HTTPSConnection
 from typing import Optional, Collection, Mapping
-from urllib.parse import urlsplit, quote
+from urllib.parse import urlencode, urljoin, urlsplit, quote
 
 from ...core.config import with_config_key
 from ...core.registry import Registry
-from .base import Input
+from ..extractors.base import Extractor
+from .base import Input, FetchRetryable
+from .cache import CachingReader, ResponseCache
+from .mixin import WithChunks, WithDedup, WithRateLimit, WithSplit
 
 
 log = logging.getLogger(__name__)
@@ -18,20 +24,106 @@ class HttpInputConfigInvalid(Exception):
     pass
 
 
-class HttpInputBadResponse(Exception):
+class HttpInputBadResponse(FetchRetryable):
     pass
 
 
+def next_link(header: Optional[str]) -> Optional[str]:
+    for link in (header or '').split(','):
+        target, *attrs = link.split(';')
+        for attr in attrs:
+            name, _, value = attr.partition('=')
+            if name.strip().lower() == 'rel' and 'next' in value.strip().strip('"').lower().split():
+                return target.strip().strip('<>')
+
+
+class DecodingReader(object):
+
+    read_bytes = 64 * 1024
+
+    def __init__(self, stream: HTTPResponse, encoding: str):
+        self._stream = stream
+        self._encoding = encoding
+        # deflate is meant to be zlib-wrapped, but some servers send raw deflate, it is detected on first chunk
+        self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+        self._started = False
+        self._finished = False
+
+    @property
+    def closed(self) -> bool:
+        return self._stream.closed
+
+    @property
+    def status(self) -> int:
+        return self._stream.status
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._stream.getheader(name, default)
+
+    def _decompress(self, data: bytes, size: int) -> bytes:
+        if self._started or self._encoding == 'gzip':
+            return self._decoder.decompress(data, size)
+        self._started = True
+        try:
+            return self._decoder.decompress(data, size)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data, size)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(partial(self.read, self.read_bytes), b''))
+        while not self._finished:
+            if self._decoder.unconsumed_tail:
+                data = self._decoder.decompress(self._decoder.unconsumed_tail, size)
+            else:
+                # whatever has arrived is decompressed, instead of waiting for a full block of compressed data
+                raw = self._stream.read1(self.read_bytes)
+                if not raw:
+                    self._finished = True
+                    return self._decoder.flush()
+                data = self._decompress(raw, size)
+            if data:
+                return data
+        return b''
+
+    def close(self) -> None:
+        self._stream.close()
+
+
 @with_config_key('url', doc='Universal Resource Locator', raise_exc=HttpInputConfigInvalid)
 @with_config_key('method', doc='HTTP verb', default='get', choices=['get', 'post', 'put', 'delete', 'head'])
 @with_config_key('headers', doc='A mapping of header names to header values')
 @with_config_key('timeout_sec', doc='Define after how many seconds consider request had no answer', default=60)
 @with_config_key('params', doc='Default values for arbitrary params')
 @with_config_key('ignore_status_codes', doc='Return None in case of response status code being one of theses')
-@with_config_key('retries', doc='Retry request exact number of times in case of empty response', default=3)
-@with_config_key('max_backoff_sec', doc='Maximum wait between retries', default=60)
+@with_config_key('retries', doc='Retry request exact number of times in case of status 4xx or 5xx', default=3)
+@with_config_key('max_backoff_sec', doc='Maximum wait between retries, unless server asks for more with Retry-After',
+                 default=60)
+@with_config_key('compression', doc='Ask for gzip or deflate compressed responses and decompress them while reading',
+                 default=True, choices=[True, False])
+@with_config_key('cache_dir', doc='Directory to cache responses in, they are revalidated with ETag or Last-Modified')
+@with_config_key('cache_ttl_sec', doc='Use cached responses without revalidating them for this number of seconds')
+@with_config_key('cache_max_bytes', doc='Evict least recently used responses above this size of cache, 0 for no limit',
+                 default=1024 ** 3)
+@with_config_key('cache_unchanged', doc='On cache hit reuse cached response as payload, or skip it with no payload',
+                 default='reuse', choices=['reuse', 'skip'])
+@with_config_key('pagination', doc='Follow pages by Link header, by cursor taken from a page, by page number or offset',
+                 choices=['link', 'cursor', 'page', 'offset'])
+@with_config_key('page_param', doc='Query parameter to pass cursor, page number or offset in')
+@with_config_key('page_start', doc='Number of first page or offset of first record, 1 and 0 by default')
+@with_config_key('page_size', doc='Number of records in a page, to calculate offset of next page')
+@with_config_key('cursor_path', doc='Path to cursor of next page in a page')
+@with_config_key('records_path', doc='Path to records in a page, pages stop at a page with no records there')
+@with_config_key('page_extractor', doc='Config of Extractor taking cursor_path and records_path from a page')
+@with_config_key('max_pages', doc='Stop after fetching this number of pages')
+@with_config_key('prefetch_pages', doc='Fetch next page while current one is parsed, not with split or chunks',
+                 default=False, choices=[True, False])
 @Registry.bind(Input, 'http')
-class HttpInput(Input):
+class HttpInput(WithSplit, WithChunks, WithRateLimit, WithDedup, Input):
+
+    read_bytes = 64 * 1024
+    empty_pages = (b'', b'[]', b'{}')
 
     def __init__(self, config):
         self.set_url(config)
@@ -56,19 +148,100 @@ class HttpInput(Input):
         self.set_max_backoff_sec(config)
         if not isinstance(self._max_backoff_sec, int) or self._max_backoff_sec < 0:
             raise HttpInputConfigInvalid('positive integer expected for max_backoff_sec')
+        self._init_split(config)
+        self._init_chunks(config)
+        self._init_rate_limit(config, urlsplit(self._url).hostname)
+        self._init_dedup(config)
+        self.set_compression(config)
+        self.set_cache_dir(config)
+        self.set_cache_ttl_sec(config)
+        if self._cache_ttl_sec is not None and (
+            not isinstance(self._cache_ttl_sec, (int, float)) or self._cache_ttl_sec < 0
+        ):
+            raise HttpInputConfigInvalid('positive number expected for cache_ttl_sec')
+        self.set_cache_max_bytes(config)
+        if not isinstance(self._cache_max_bytes, int) or self._cache_max_bytes < 0:
+            raise HttpInputConfigInvalid('positive integer expected for cache_max_bytes')
+        self.set_cache_unchanged(config)
+        self._cache = None
+        if self._cache_dir is not None:
+            self._cache = ResponseCache(self._cache_dir, self._cache_ttl_sec, self._cache_max_bytes)
+        # responses read by this input, they are staged by commit() and published once batch commits
+        self._cache_writers = []
+        self._shares_cache = False
+        self._init_pagination(config)
         self._response = None
+        self._fetching = False
+        self._page_params = {}
+        self._pages = 0
+        self._next_page = None
+        self._prefetched = None
+        self._prefetcher = None
+        self._counters = {'redirects': 0, 'cache_hits': 0, 'not_modified': 0, 'compressed': 0, 'pages': 0}
+        # next page may be fetched by prefetching thread
+        self._counters_lock = threading.Lock()
         self._fixed_headers = OrderedDict({
             'User-Agent': 'batchout.HttpInput',
             'Accept': '*/*',
             'Connection': 'keep-alive',
         })
+        if self._compression:
+            self._fixed_headers['Accept-Encoding'] = 'gzip, deflate'
         for k, v in (self._headers or {}).items():
             k = '-'.join(p.capitalize() for p in k.strip().split('-'))
             self._fixed_headers[k] = v.strip()
 
+    def _init_pagination(self, config):
+        self.set_pagination(config)
+        self.set_page_param(config)
+        self.set_page_start(config)
+        self.set_page_size(config)
+        self.set_cursor_path(config)
+        self.set_records_path(config)
+        self.set_page_extractor(config)
+        self.set_max_pages(config)
+        self.set_prefetch_pages(config)
+        if self._pagination not in (None, self.pagination_link) and not self._page_param:
+            raise HttpInputConfigInvalid(f'page_param is required for {self._pagination} pagination')
+        if self._page_start is None:
+            self._page_start = 1 if self._pagination == self.pagination_page else 0
+        if not isinstance(self._page_start, int):
+            raise HttpInputConfigInvalid('integer expected for page_start')
+        if self._pagination == self.pagination_offset and (
+            not isinstance(self._page_size, int) or self._page_size <= 0
+        ):
+            raise HttpInputConfigInvalid('positive integer expected for page_size')
+        if self._max_pages is not None and (not isinstance(self._max_pages, int) or self._max_pages <= 0):
+            raise HttpInputConfigInvalid('positive integer expected for max_pages')
+        if self._pagination == self.pagination_cursor:
+            if not self._cursor_path:
+                raise HttpInputConfigInvalid('cursor_path is required for cursor pagination')
+            if self._split is not None or self._chunked or self._cache_unchanged == self.cache_unchanged_skip:
+                raise HttpInputConfigInvalid('cursor pagination needs whole pages, it cannot be used with split, '
+                                             'chunks or cache_unchanged: skip')
+        if self._records_path and (self._pagination is None or self._split is not None or self._chunked):
+            raise HttpInputConfigInvalid('records_path needs pagination and whole pages, it cannot be used with '
+                                         'split or chunks')
+        if self._pagination in (self.pagination_page, self.pagination_offset) and not (
+            self._records_path or self._max_pages or self._split is not None
+        ):
+            # pages past the end are often not empty, e.g. {"items": [], "total": 0}
+            raise HttpInputConfigInvalid(f'records_path, max_pages or split is required for {self._pagination} '
+                                         f'pagination to know where pages end')
+        self._page_extractor_instance = None
+        if self._cursor_path or self._records_path:
+            if not isinstance(self._page_extractor, Mapping):
+                raise HttpInputConfigInvalid('page_extractor is required for cursor_path and records_path')
+            self._page_extractor_instance = Registry.create(Extractor, self._page_extractor)
+        if self._prefetch_pages and (self._split is not None or self._chunked):
+            raise HttpInputConfigInvalid('prefetch_pages cannot be used together with split or chunks')
+
     def fetch(self, **params) -> Optional[bytes]:
-        if self._response:
-            return
+        if self._fetching:
+            payload = self._fetch_record()
+            if payload is None and self._next_page is not None:
+                payload = self._fetch_pages(self._next_page)
+            return payload
         if self._params:
             params = {
                 p: quote(params.get(p, d))
@@ -79,44 +252,259 @@ class HttpInput(Input):
                 return
         else:
             params = {}
-        retries = 0
-        redirects = 0
-        location = self._url
-        while self._response is None:
-            url = urlsplit(location, allow_fragments=False)
-            if url.scheme.lower() == 'https':
-                conn_cls = HTTPSConnection
-            else:
-                conn_cls = HTTPConnection
-            conn = conn_cls(host=url.hostname, port=url.port, timeout=float(self._timeout_sec))
-            path = url.path
-            if url.query:
-                path += '?' + url.query
-            conn.putrequest(self._method.upper(), path.format(**params))
-            for k, v in self._fixed_headers.items():
-                conn.putheader(k, v)
-            conn.endheaders()
-            self._response = conn.getresponse()
-            if 300 <= self._response.status < 400 and redirects < 10:
-                location = self._response.getheader('Location')
-                redirects += 1
+        self._fetching = True
+        self._page_params, self._pages = params, 0
+        if self._pagination in (self.pagination_page, self.pagination_offset):
+            return self._fetch_pages((self._url, self._page_start))
+        return self._fetch_pages((self._url, None))
+
+    def _fetch_pages(self, page) -> Optional[bytes]:
+        self._next_page = None
+        while page is not None and (self._max_pages is None or self._pages < self._max_pages):
+            self._pages += 1
+            prefetched, self._prefetched = self._prefetched, None
+            try:
+                fetched = self._fetch_page(page) if prefetched is None else prefetched.result()
+            except FetchRetryable:
+                # fetch() called again retries this page, pages before it are not fetched again
+                self._pages -= 1
+                self._next_page = page
+                raise
+            if fetched is None:
+                break
+            payload, link, skipped = fetched
+            page = self._following_page(page, payload, link, skipped)
+            if payload is None:
                 continue
-            if self._ignore_status_codes and self._response.status in self._ignore_status_codes:
+            self._next_page = page
+            if page is not None and self._prefetch_pages and (self._max_pages is None or self._pages < self._max_pages):
+                if self._prefetcher is None:
+                    self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batchout-http-prefetch')
+                self._prefetched = self._prefetcher.submit(self._fetch_page, page)
+            return payload
+        self._stop_prefetching()
+
+    def _fetch_page(self, page) -> Optional[tuple[Optional[bytes], Optional[str], bool]]:
+        opened = self._open(*page)
+        if opened is None:
+            return
+        self._count('pages')
+        response, link = opened
+        if response is None:
+            return None, link, True
+        if self._split is not None or self._chunked:
+            # prefetching is not allowed with split or chunks, so only the calling thread gets here
+            self._response = response
+            payload = self._fetch_record()
+            if self._chunked and self._pagination is not None and payload is not None and (
+                payload.strip() in self.empty_pages
+            ):
+                # page holding nothing but [] or {} is empty, unless more chunks follow
+                following = self._fetch_record()
+                if following is None:
+                    return None, link, False
+                self._unread_chunk(following)
+            return payload, link, False
+        payload = bytearray()
+        with closing(response):
+            # reading up to the end also commits the body to cache
+            for chunk in iter(partial(response.read, self.read_bytes), b''):
+                payload += chunk
+        payload = bytes(payload)
+        if self._pagination is not None and (payload.strip() in self.empty_pages or not self._has_records(payload)):
+            return None, link, False
+        return payload, link, False
+
+    def _page_value(self, path: str, payload: bytes):
+        try:
+            return self._page_extractor_instance.extract_value(path, payload)
+        finally:
+            self._page_extractor_instance.release(payload)
+
+    def _has_records(self, payload: bytes) -> bool:
+        if not self._records_path:
+            return True
+        records = self._page_value(self._records_path, payload)
+        return records not in (None, '') and not (isinstance(records, (list, tuple, dict)) and not records)
+
+    def _following_page(self, page, payload: Optional[bytes], link: Optional[str], skipped: bool):
+        location, value = page
+        if self._pagination == self.pagination_link:
+            return (urljoin(location, link), None) if link else None
+        elif self._pagination == self.pagination_cursor:
+            if payload is None:
                 return
-            if 400 <= self._response.status < 600 and retries < self._retries:
-                self._response = None
-                retries += 1
-                time.sleep(min(self._max_backoff_sec, retries ** 2))
-        payload = None
-        with closing(self._response) as response:
-            if 400 <= response.status < 600:
-                raise HttpInputBadResponse(response.read().decode())
-            else:
-                payload = response.read()
+            cursor = self._page_value(self._cursor_path, payload)
+            return (self._url, cursor) if cursor not in (None, '') else None
+        elif self._pagination in (self.pagination_page, self.pagination_offset):
+            if payload is None and not skipped:
+                return
+            return self._url, value + (1 if self._pagination == self.pagination_page else self._page_size)
+
+    def _open(self, location: str, page_value=None):
+        params = self._page_params
+        query = urlencode({self._page_param: page_value}) if page_value is not None else None
+        cache_key, cached, cached_body = None, None, None
+        if self._cache is not None and self._method == self.method_get:
+            cache_key = self._cache.key(
+                self._method, location, query or '', *(f'{k}={v}' for k, v in sorted(params.items())),
+            )
+            cached = self._cache.get(cache_key)
+            # body is opened right away, so that it survives eviction by other threads until it is used
+            cached_body = self._cache.open(cache_key) if cached is not None else None
+            if cached_body is None:
+                cached = None
+            elif self._cache.is_fresh(cached):
+                return self._from_cache(cached_body), cached.get('link')
+        redirects = 0
+        response = None
+        try:
+            while response is None:
+                url = urlsplit(location, allow_fragments=False)
+                if url.scheme.lower() == 'https':
+                    conn_cls = HTTPSConnection
+                else:
+                    conn_cls = HTTPConnection
+                self._wait_for_rate(url.hostname)
+                conn = conn_cls(host=url.hostname, port=url.port, timeout=float(self._timeout_sec))
+                path = url.path
+                if url.query:
+                    path += '?' + url.query
+                if location == self._url:
+                    path = path.format(**params)
+                if query is not None and not redirects:
+                    path += ('&' if url.query else '?') + query
+                conn.putrequest(
+                    self._method.upper(), path,
+                    skip_accept_encoding='Accept-Encoding' in self._fixed_headers,
+                )
+                for k, v in self._fixed_headers.items():
+                    conn.putheader(k, v)
+                if cached is not None and cached.get('etag'):
+                    conn.putheader('If-None-Match', cached['etag'])
+                if cached is not None and cached.get('last_modified'):
+                    conn.putheader('If-Modified-Since', cached['last_modified'])
+                conn.endheaders()
+                response = conn.getresponse()
+                if 300 <= response.status < 400 and response.status != 304 and redirects < 10:
+                    location = response.getheader('Location')
+                    response.close()
+                    response = None
+                    redirects += 1
+                    self._count('redirects')
+        except BaseException:
+            if cached_body is not None:
+                cached_body.close()
+            raise
+        response = self._decoded(response)
+        link = next_link(response.getheader('Link'))
+        if cached_body is not None and response.status == 304:
+            response.close()
+            self._count('not_modified')
+            self._cache.refresh(cache_key, cached)
+            return self._from_cache(cached_body), cached.get('link')
+        if cached_body is not None:
+            cached_body.close()
+        if self._ignore_status_codes and response.status in self._ignore_status_codes:
+            response.close()
+            return
+        if 400 <= response.status < 600:
+            # retries are scheduled by reader tasks, so that waiting for them doesn't hold a thread
+            with closing(response):
+                retry_after = response.getheader('Retry-After', '')
+                raise HttpInputBadResponse(
+                    response.read().decode(errors='replace'),
+                    retries=self._retries,
+                    max_backoff_sec=self._max_backoff_sec,
+                    retry_after_sec=float(retry_after) if retry_after.isdigit() else None,
+                    throttled=response.status == 429 or response.status >= 500,
+                )
+        etag, last_modified = response.getheader('ETag'), response.getheader('Last-Modified')
+        if cache_key is not None and response.status == 200 and (
+            etag or last_modified or self._cache_ttl_sec is not None
+        ):
+            writer = self._cache.writer(cache_key, url=location, etag=etag, last_modified=last_modified, link=link)
+            self._cache_writers.append(writer)
+            response = CachingReader(response, writer)
+        return response, link
+
+    def _decoded(self, response):
+        encoding = (response.getheader('Content-Encoding') or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip'):
+            encoding = 'gzip'
+        elif encoding != 'deflate':
+            return response
+        self._count('compressed')
+        return DecodingReader(response, encoding)
+
+    def _from_cache(self, body):
+        self._count('cache_hits')
+        if self._cache_unchanged == self.cache_unchanged_skip:
+            body.close()
+            return
+        return body
+
+    def _fetch_record(self) -> Optional[bytes]:
+        if self._response is None:
+            return
+        if self._split is not None:
+            payload = self._read_record(self._response.read)
+        else:
+            payload = self._read_chunk(self._response.read)
+        if payload is None:
+            self._response.close()
+            self._response = None
+            self._reset_split()
+            self._reset_chunks()
         return payload
 
+    def _stop_prefetching(self):
+        if self._prefetched is not None:
+            self._prefetched.cancel()
+            self._prefetched = None
+        if self._prefetcher is not None:
+            # a page being fetched is waited for, so that no thread outlives the input
+            self._prefetcher.shutdown(wait=True, cancel_futures=True)
+            self._prefetcher = None
+
+    def _count(self, counter: str) -> None:
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    def counters(self) -> dict[str, int]:
+        with self._counters_lock:
+            return {**self._counters, 'rate_waits': self._rate_waits}
+
+    def share_state(self, master) -> None:
+        if self._cache is not None:
+            self._cache = master._cache
+            self._shares_cache = True
+        super().share_state(master)
+
     def commit(self):
-        pass
+        self._stop_prefetching()
+        if self._cache is None:
+            return
+        self._cache.stage(*self._cache_writers)
+        self._cache_writers = []
+        # clones leave staged responses to the master input, which commits after outputs
+        if not self._shares_cache:
+            self._cache.commit()
+
+    def rollback(self):
+        if self._cache is not None:
+            self._cache.rollback()
 
     def reset(self):
+        self._reset_rate_limit()
+        self._stop_prefetching()
+        for writer in self._cache_writers:
+            writer.abort()
+        self._cache_writers = []
+        if self._response is not None:
+            self._response.close()
         self._response = None
+        self._fetching = False
+        self._next_page = None
+        self._reset_split()
+        self._reset_chunks()
@@ -0,0 +1,543 @@
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+from ...core.config import with_config_key
+
+
+class SplitConfigInvalid(Exception):
+    pass
+
+
+class SplitFailed(Exception):
+    pass
+
+
+class ChunksConfigInvalid(Exception):
+    pass
+
+
+class RateLimitConfigInvalid(Exception):
+    pass
+
+
+class DedupConfigInvalid(Exception):
+    pass
+
+
+class XmlSplitter(object):
+
+    def __init__(self, tag: str):
+        self._tag = tag
+        self._parser = expat.ParserCreate()
+        self._parser.XmlDeclHandler = self._on_decl
+        self._parser.StartElementHandler = self._on_start
+        self._parser.EndElementHandler = self._on_end
+        self._encoding = 'utf-8'
+        self._buffer = bytearray()
+        self._offset = 0
+        self._scopes = []
+        self._start = None
+        self._start_name = None
+        self._start_depth = None
+        self._namespaces = None
+        self._records = []
+        self._closed = False
+
+    def _on_decl(self, _version, encoding, _standalone):
+        if encoding:
+            self._encoding = encoding
+
+    def _on_start(self, name, attrs):
+        declared = {k: v for k, v in attrs.items() if k == 'xmlns' or k.startswith('xmlns:')}
+        if self._start is None and name.rsplit(':', 1)[-1] == self._tag:
+            self._start = self._parser.CurrentByteIndex
+            self._start_name = name
+            self._start_depth = len(self._scopes)
+            self._namespaces = {}
+            for scope in self._scopes:
+                self._namespaces.update(scope)
+            for k in declared:
+                self._namespaces.pop(k, None)
+        self._scopes.append(declared)
+
+    def _on_end(self, name):
+        self._scopes.pop()
+        if self._start is None or len(self._scopes) != self._start_depth:
+            return
+        # expat points at "</tag>" of an element with content and right after "<tag/>" of an empty one
+        end = self._parser.CurrentByteIndex - self._offset
+        closing = f'</{name}'.encode(self._encoding)
+        if self._buffer.startswith(closing, end) and self._buffer[end + len(closing)] in b' \t\r\n>':
+            end = self._buffer.index(b'>', end) + 1
+        self._records.append(self._record(bytes(self._buffer[self._start - self._offset:end])))
+        self._start = None
+
+    def _record(self, raw: bytes) -> bytes:
+        record = raw.decode(self._encoding)
+        if self._namespaces:
+            # namespaces declared by ancestors are copied so that each record is a well-formed document
+            pos = 1 + len(self._start_name)
+            declared = ''.join(f' {k}={quoteattr(v)}' for k, v in self._namespaces.items())
+            record = record[:pos] + declared + record[pos:]
+        return record.encode('utf8')
+
+    def _flush(self) -> list[bytes]:
+        if self._start is None:
+            # the last tag may be incomplete and not parsed yet
+            cut = self._buffer.rfind(b'<')
+            cut = len(self._buffer) if cut < 0 else cut
+        else:
+            cut = self._start - self._offset
+        del self._buffer[:cut]
+        self._offset += cut
+        records, self._records = self._records, []
+        return records
+
+    def feed(self, data: bytes) -> list[bytes]:
+        self._buffer += data
+        self._parser.Parse(data, False)
+        return self._flush()
+
+    def close(self) -> list[bytes]:
+        if self._closed:
+            return []
+        self._closed = True
+        self._parser.Parse(b'', True)
+        return self._flush()
+
+
+class JsonSplitter(object):
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._closed = False
+
+    def _skip_ws(self) -> bool:
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+            self._pos += 1
+        return self._pos < len(self._buffer)
+
+    def _records(self, final: bool) -> list[bytes]:
+        records = []
+        while self._state != 'end' and self._skip_ws():
+            char = self._buffer[self._pos]
+            if self._state == 'start':
+                if char != '[':
+                    raise SplitFailed(f'JSON array expected, found {char!r}')
+                self._pos += 1
+                self._state = 'first'
+            elif self._state in ('first', 'next') and char == ']':
+                self._pos += 1
+                self._state = 'end'
+            elif self._state == 'next':
+                if char != ',':
+                    raise SplitFailed(f'"," or "]" expected after array element, found {char!r}')
+                self._pos += 1
+                self._state = 'element'
+            else:
+                try:
+                    _, end = self._json.raw_decode(self._buffer, self._pos)
+                except json.JSONDecodeError as exc:
+                    if final:
+                        raise SplitFailed(f'invalid JSON array element: {exc}')
+                    break
+                # a number cut by the end of data, as in "12345." or "1e", may continue in the next block
+                if not final and (end == len(self._buffer) or self._buffer[end] not in ', \t\r\n]'):
+                    break
+                records.append(self._buffer[self._pos:end].encode('utf8'))
+                self._pos = end
+                self._state = 'next'
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        if final and self._state != 'end':
+            raise SplitFailed('JSON array is not complete')
+        return records
+
+    def feed(self, data: bytes) -> list[bytes]:
+        self._buffer += self._decoder.decode(data)
+        return self._records(False)
+
+    def close(self) -> list[bytes]:
+        if self._closed:
+            return []
+        self._closed = True
+        self._buffer += self._decoder.decode(b'', True)
+        return self._records(True)
+
+
+class NdjsonSplitter(object):
+
+    def __init__(self):
+        self._buffer = b''
+
+    def feed(self, data: bytes) -> list[bytes]:
+        *lines, self._buffer = (self._buffer + data).split(b'\n')
+        return [line for line in map(bytes.strip, lines) if line]
+
+    def close(self) -> list[bytes]:
+        line, self._buffer = self._buffer.strip(), b''
+        return [line] if line else []
+
+
+with_split = with_config_key(
+    'split',
+    doc='Split data into records and fetch them one by one as payloads',
+    choices=('xml', 'json', 'ndjson'),
+)
+with_split_tag = with_config_key(
+    'split_tag',
+    doc='Name of XML element holding a record, required to split XML',
+)
+
+
+@with_split
+@with_split_tag
+class WithSplit(object):
+
+    split_read_bytes = 64 * 1024
+
+    def _init_split(self, config):
+        self.set_split(config)
+        self.set_split_tag(config)
+        if self._split == self.split_xml and not self._split_tag:
+            raise SplitConfigInvalid('split_tag is required to split XML')
+        self._reset_split()
+
+    def _reset_split(self):
+        self._splitter = None
+        self._split_records = deque()
+
+    def _new_splitter(self):
+        if self._split == self.split_xml:
+            return XmlSplitter(self._split_tag)
+        elif self._split == self.split_json:
+            return JsonSplitter()
+        elif self._split == self.split_ndjson:
+            return NdjsonSplitter()
+
+    def _read_record(self, read: Callable[[int], bytes]) -> Optional[bytes]:
+        if self._splitter is None:
+            self._splitter = self._new_splitter()
+        while not self._split_records:
+            data = read(self.split_read_bytes)
+            if not data:
+                self._split_records.extend(self._splitter.close())
+                break
+            self._split_records.extend(self._splitter.feed(data))
+        return self._split_records.popleft() if self._split_records else None
+
+
+with_chunk_bytes = with_config_key(
+    'chunk_bytes',
+    doc='Maximum number of bytes per chunk, used to split data in chunks',
+)
+with_chunk_endswith = with_config_key(
+    'chunk_endswith',
+    doc='Sequence of bytes delimiting chunks of data, used to split data in chunks',
+)
+
+
+@with_chunk_bytes
+@with_chunk_endswith
+class WithChunks(object):
+
+    chunk_read_bytes = 64 * 1024
+
+    def _init_chunks(self, config):
+        self.set_chunk_bytes(config)
+        try:
+            self._chunk_bytes = int(self._chunk_bytes) if self._chunk_bytes is not None else None
+        except ValueError:
+            raise ChunksConfigInvalid('chunk_bytes should be an integer, given: %s', self._chunk_bytes)
+        if self._chunk_bytes is not None and self._chunk_bytes <= 0:
+            raise ChunksConfigInvalid('chunk_bytes should be positive, given: %s', self._chunk_bytes)
+        self.set_chunk_endswith(config)
+        self._chunk_mark = self._chunk_endswith.encode() if self._chunk_endswith else None
+        if self._chunked and getattr(self, '_split', None) is not None:
+            raise ChunksConfigInvalid('split cannot be used together with chunk_bytes or chunk_endswith')
+        self._reset_chunks()
+
+    @property
+    def _chunked(self) -> bool:
+        return self._chunk_bytes is not None or self._chunk_mark is not None
+
+    def _reset_chunks(self):
+        self._chunk_buffer = b''
+
+    def _unread_chunk(self, chunk: bytes):
+        self._chunk_buffer = chunk + self._chunk_buffer
+
+    def _read_chunk(self, read: Callable[[int], bytes]) -> Optional[bytes]:
+        payload, self._chunk_buffer = bytearray(self._chunk_buffer), b''
+        mark = self._chunk_mark
+        if self._chunk_bytes is not None:
+            # streams like sockets return less than asked for, so chunk is filled up by several reads
+            while len(payload) < self._chunk_bytes:
+                data = read(self._chunk_bytes - len(payload))
+                if not data:
+                    break
+                payload += data
+            self._chunk_buffer = bytes(payload[self._chunk_bytes:])
+            del payload[self._chunk_bytes:]
+        elif mark is not None:
+            searched = 0
+            while payload.find(mark, searched) < 0:
+                # mark can straddle two reads
+                searched = max(0, len(payload) - len(mark) + 1)
+                data = read(self.chunk_read_bytes)
+                if not data:
+                    break
+                payload += data
+        if mark is not None:
+            end = payload.find(mark)
+            if end >= 0:
+                end += len(mark)
+                self._chunk_buffer = bytes(payload[end:]) + self._chunk_buffer
+                del payload[end:]
+        return bytes(payload) or None
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate_per_sec: float, burst: int):
+        self._rate_per_sec = float(rate_per_sec)
+        self._burst = float(burst)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def limits(self) -> tuple[float, float]:
+        return self._rate_per_sec, self._burst
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate_per_sec)
+            self._updated = now
+            # a token is taken even if it is not there yet, so concurrent callers queue up instead of racing
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self._rate_per_sec)
+
+    def acquire(self) -> float:
+        wait_sec = self.reserve()
+        if wait_sec > 0:
+            time.sleep(wait_sec)
+        return wait_sec
+
+
+class HostBuckets(object):
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str, rate_per_sec: float, burst: int) -> TokenBucket:
+        host = host.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(rate_per_sec, burst)
+            elif bucket.limits != (float(rate_per_sec), float(burst)):
+                raise RateLimitConfigInvalid(
+                    f'host {host} is limited to host_rate_per_sec={bucket.limits[0]:g} '
+                    f'and host_rate_burst={bucket.limits[1]:g} by another input already'
+                )
+            return bucket
+
+
+with_rate_per_sec = with_config_key(
+    'rate_per_sec',
+    doc='Maximum requests per second, shared by all threads reading this input',
+)
+with_rate_burst = with_config_key(
+    'rate_burst',
+    doc='Number of requests allowed at once before rate_per_sec applies',
+    default=1,
+)
+with_host_rate_per_sec = with_config_key(
+    'host_rate_per_sec',
+    doc='Maximum requests per second to one host, shared by all inputs requesting it',
+)
+with_host_rate_burst = with_config_key(
+    'host_rate_burst',
+    doc='Number of requests to one host allowed at once before host_rate_per_sec applies',
+    default=1,
+)
+
+
+@with_rate_per_sec
+@with_rate_burst
+@with_host_rate_per_sec
+@with_host_rate_burst
+class WithRateLimit(object):
+
+    def _init_rate_limit(self, config, host: Optional[str] = None):
+        self.set_rate_per_sec(config)
+        self.set_rate_burst(config)
+        self.set_host_rate_per_sec(config)
+        self.set_host_rate_burst(config)
+        for rate, burst in (('rate_per_sec', 'rate_burst'), ('host_rate_per_sec', 'host_rate_burst')):
+            rate_value, burst_value = getattr(self, f'_{rate}'), getattr(self, f'_{burst}')
+            if rate_value is not None and (not isinstance(rate_value, (int, float)) or rate_value <= 0):
+                raise RateLimitConfigInvalid(f'positive number expected for {rate}')
+            if not isinstance(burst_value, int) or burst_value <= 0:
+                raise RateLimitConfigInvalid(f'positive integer expected for {burst}')
+        self._rate_host = host
+        self._rate_bucket = None
+        if self._rate_per_sec is not None:
+            self._rate_bucket = TokenBucket(self._rate_per_sec, self._rate_burst)
+        self._rate_lock = threading.Lock()
+        self._rate_prepaid = 0
+        self._rate_waits = 0
+        # buckets of hosts are shared by inputs of a batch, an input on its own has buckets of its own
+        self._host_buckets = HostBuckets()
+
+    def _rate_buckets(self, host: Optional[str] = None) -> list[TokenBucket]:
+        buckets = [self._rate_bucket] if self._rate_bucket is not None else []
+        if self._host_rate_per_sec is not None and host:
+            buckets.append(self._host_buckets.get(host, self._host_rate_per_sec, self._host_rate_burst))
+        return buckets
+
+    def share_batch_state(self, state: dict) -> None:
+        self._host_buckets = state.setdefault('host_buckets', HostBuckets())
+        # limits of the host known upfront are checked against other inputs of the batch right away
+        self._rate_buckets(self._rate_host)
+        super().share_batch_state(state)
+
+    def reserve_read(self) -> float:
+        buckets = self._rate_buckets(self._rate_host)
+        if not buckets:
+            return 0.0
+        # tokens for first request of a read are taken by reader, which delays the read until they are due
+        wait_sec = max(bucket.reserve() for bucket in buckets)
+        with self._rate_lock:
+            self._rate_prepaid += 1
+        return wait_sec
+
+    def share_state(self, master) -> None:
+        self._rate_bucket = master._rate_bucket
+        self._host_buckets = master._host_buckets
+        with master._rate_lock:
+            if master._rate_prepaid:
+                master._rate_prepaid -= 1
+                self._rate_prepaid += 1
+        super().share_state(master)
+
+    def _reset_rate_limit(self) -> None:
+        with self._rate_lock:
+            self._rate_prepaid = 0
+
+    def _wait_for_rate(self, host: Optional[str] = None) -> None:
+        with self._rate_lock:
+            if self._rate_prepaid:
+                self._rate_prepaid -= 1
+                return
+        for bucket in self._rate_buckets(host):
+            if bucket.acquire() > 0:
+                with self._rate_lock:
+                    self._rate_waits += 1
+
+
+class ContentHashes(object):
+
+    def __init__(self, max_entries: int, path: Optional[str] = None):
+        self._max_entries = max_entries
+        self._path = path
+        self._committed = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self._committed[bytes.fromhex(line.strip())] = None
+            self._trim()
+
+    @staticmethod
+    def digest(payload: bytes) -> bytes:
+        return hashlib.blake2b(payload, digest_size=16).digest()
+
+    def _trim(self) -> None:
+        while len(self._committed) > self._max_entries:
+            self._committed.popitem(last=False)
+
+    def seen(self, digest: bytes) -> bool:
+        with self._lock:
+            if digest in self._committed:
+                self._committed.move_to_end(digest)
+                return True
+            self._pending.add(digest)
+            return False
+
+    def commit(self) -> None:
+        with self._lock:
+            for digest in self._pending:
+                self._committed[digest] = None
+            self._pending.clear()
+            self._trim()
+            if self._path is None:
+                return
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self._path)), prefix='.tmp-')
+            with os.fdopen(fd, mode='w') as f:
+                f.writelines(digest.hex() + '\n' for digest in self._committed)
+            os.replace(tmp_path, self._path)
+
+    def rollback(self) -> None:
+        with self._lock:
+            self._pending.clear()
+
+
+with_dedup = with_config_key(
+    'dedup',
+    doc='Skip payloads identical to ones already read in previous batches',
+    default=False,
+    choices=(True, False),
+)
+with_dedup_max_entries = with_config_key(
+    'dedup_max_entries',
+    doc='Number of hashes of payloads to remember, least recently seen are forgotten first',
+    default=100000,
+)
+with_dedup_path = with_config_key(
+    'dedup_path',
+    doc='File to keep hashes of payloads in between runs, they are kept only in memory by default',
+)
+
+
+@with_dedup
+@with_dedup_max_entries
+@with_dedup_path
+class WithDedup(object):
+
+    def _init_dedup(self, config):
+        self.set_dedup(config)
+        self.set_dedup_max_entries(config)
+        if not isinstance(self._dedup_max_entries, int) or self._dedup_max_entries <= 0:
+            raise DedupConfigInvalid('positive integer expected for dedup_max_entries')
+        self.set_dedup_path(config)
+        self._content_hashes = None
+
+    def content_hashes(self) -> Optional[ContentHashes]:
+        # hashes are created on first use, clones of an input use hashes of the master instead
+        if self._dedup and self._content_hashes is None:
+            self._content_hashes = ContentHashes(self._dedup_max_entries, self._dedup_path)
+        return self._content_hashes
+
+    def share_state(self, master) -> None:
+        if self._dedup:
+            self._content_hashes = master.content_hashes()
+        super().share_state(master)
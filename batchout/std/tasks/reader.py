@@ -12,7 +12,15 @@ class ReaderTaskConfigInvalid(Exception):
 
 
 @with_config_key('selector')
+@with_config_key('max_index_combinations',
+                 doc='Stop parsing a payload after this number of combinations of index values')
 @with_config_key('threads', default=1, raise_exc=ReaderTaskConfigInvalid)
+@with_config_key('min_threads',
+                 doc='Adapt number of parallel reads between min_threads and threads to latency and errors of inputs')
+@with_config_key('retry_deadline_sec',
+                 doc='Stop retrying fetches for a tuple of params after this number of seconds since first failure')
+@with_config_key('progress_sec',
+                 doc='Log progress of reading every N seconds instead of a line per read (lines per read go to DEBUG)')
 @with_config_key('inputs', raise_exc=ReaderTaskConfigInvalid)
 @Registry.bind(Task, str(Task.TYPE_READER))
 class ReaderTask(Task):
@@ -23,6 +31,26 @@ class ReaderTask(Task):
         self.set_threads(config)
         if not isinstance(self._threads, int) or self._threads <= 0:
             raise ReaderTaskConfigInvalid('positive integer greater than 0 expected for threads')
+        self.set_min_threads(config)
+        if self._min_threads is not None and (
+            not isinstance(self._min_threads, int) or not 0 < self._min_threads <= self._threads
+        ):
+            raise ReaderTaskConfigInvalid('positive integer not greater than threads expected for min_threads')
+        self.set_max_index_combinations(config)
+        if self._max_index_combinations is not None and (
+            not isinstance(self._max_index_combinations, int) or self._max_index_combinations <= 0
+        ):
+            raise ReaderTaskConfigInvalid('positive integer greater than 0 expected for max_index_combinations')
+        self.set_retry_deadline_sec(config)
+        if self._retry_deadline_sec is not None and (
+            not isinstance(self._retry_deadline_sec, (int, float)) or self._retry_deadline_sec <= 0
+        ):
+            raise ReaderTaskConfigInvalid('positive number expected for retry_deadline_sec')
+        self.set_progress_sec(config)
+        if self._progress_sec is not None and (
+            not isinstance(self._progress_sec, (int, float)) or self._progress_sec <= 0
+        ):
+            raise ReaderTaskConfigInvalid('positive number expected for progress_sec')
 
     def type(self):
         return Task.TYPE_READER
@@ -32,4 +60,8 @@ class ReaderTask(Task):
             'selector': self._selector,
             'inputs': self._inputs or [],
             'threads': self._threads,
+            'min_threads': self._min_threads,
+            'max_index_combinations': self._max_index_combinations,
+            'progress_sec': self._progress_sec,
+            'retry_deadline_sec': self._retry_deadline_sec,
         }
@@ -0,0 +1,69 @@
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from . import e2e, stages  # noqa: F401, benchmarks are registered on import
+from .harness import measure, select
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results: list[dict], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        ratio = result['seconds_min'] / before['seconds_min']
+        print(f"{result['name']:45} {before['seconds_min']:12.6f} {result['seconds_min']:12.6f} {ratio:7.2f}x",
+              file=sys.stderr)
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description='Run Batchout benchmarks')
+    argparser.add_argument('patterns', nargs='*', help='Run only benchmarks matching glob patterns')
+    argparser.add_argument('-r', '--repeat', default=5, type=int, help='Number of samples per benchmark')
+    argparser.add_argument('-o', '--output', help='Write results as JSON to a file instead of stdout')
+    argparser.add_argument('-c', '--compare', help='Compare results with JSON results of a previous run')
+    argparser.add_argument('-l', '--list', action='store_true', help='List benchmarks and exit')
+    args = argparser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    names = select(args.patterns)
+    if args.list:
+        print('\n'.join(names))
+        return
+    results = []
+    for name in names:
+        results.append(measure(name, repeat=args.repeat))
+        print(f"{name:45} {results[-1]['seconds_min']:12.6f} s {results[-1]['items_per_sec']:14.1f} items/s",
+              file=sys.stderr)
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, mode='w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
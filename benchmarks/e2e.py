@@ -0,0 +1,103 @@
+import atexit
+import os
+import tempfile
+from typing import Any, Collection, Iterable
+
+from batchout import Batch, Output
+from batchout.core.registry import Registry
+
+from . import payloads
+from .harness import benchmark
+
+
+@Registry.bind(Output, 'null')
+class NullOutput(Output):
+
+    def __init__(self, _):
+        pass
+
+    def ingest(self, columns: Collection[str], rows: Iterable[Collection[Any]]) -> int:
+        return sum(1 for _ in rows)
+
+    def commit(self):
+        pass
+
+
+def _batch(inputs, extractor, columns, maps):
+    return Batch.from_config(dict(
+        inputs=inputs,
+        extractors=dict(default=extractor),
+        indexes=dict(
+            outer=dict(type='for_list', path='items'),
+            inner=dict(type='for_list', path='items[{outer}].items'),
+        ),
+        columns=columns,
+        maps=maps,
+        selectors=dict(
+            rows=dict(type='sql', query=f"select {', '.join(columns)} from records", columns=list(columns)),
+        ),
+        outputs=dict(null=dict(type='null')),
+        tasks=dict(
+            read=dict(type='reader', inputs=list(inputs)),
+            write=dict(type='writer', selector='rows', outputs=['null']),
+        ),
+    ), defaults=dict(indexes=dict(extractor='default'), columns=dict(extractor='default')))
+
+
+NESTED_COLUMNS = dict(
+    f0=dict(type='string', path='f0'),
+    f1=dict(type='string', path='items[{outer}].f1'),
+    f2=dict(type='string', path='items[{outer}].items[{inner}].f2'),
+    f3=dict(type='string', path='items[{outer}].items[{inner}].f3'),
+)
+NESTED_MAPS = dict(records=['f0', {'outer': ['f1', {'inner': ['f2', 'f3']}]}])
+
+
+def _const_json(extractor_type):
+    data = [payloads.json_payload(seed=i, width=5, depth=2).decode() for i in range(20)]
+    batch = _batch(dict(records=dict(type='const', data=data)), dict(type=extractor_type), NESTED_COLUMNS, NESTED_MAPS)
+    return batch.run_once
+
+
+@benchmark('run_once.const_json.jsonpath', items=20 * 5 * 5)
+def run_once_const_json_jsonpath():
+    return _const_json('jsonpath')
+
+
+@benchmark('run_once.const_json.jsonpath_fast', items=20 * 5 * 5)
+def run_once_const_json_jsonpath_fast():
+    return _const_json('jsonpath_fast')
+
+
+def _file(data):
+    fd, path = tempfile.mkstemp(prefix='batchout-benchmark-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    atexit.register(os.remove, path)
+    return path
+
+
+@benchmark('run_once.file_split_json', items=1000)
+def run_once_file_split_json():
+    path = _file(payloads.json_array(records=1000, width=5, depth=0))
+    columns = {f'f{i}': dict(type='string', path=f'f{i}') for i in range(5)}
+    batch = _batch(
+        dict(records=dict(type='file', path=path, split='json')),
+        dict(type='jsonpath_fast'),
+        columns,
+        dict(records=list(columns)),
+    )
+    return batch.run_once
+
+
+@benchmark('run_once.file_split_xml', items=1000)
+def run_once_file_split_xml():
+    path = _file(payloads.xml_feed(records=1000, width=5, depth=0))
+    columns = {f'f{i}': dict(type='string', path=f'/record/f{i}/text()') for i in range(5)}
+    batch = _batch(
+        dict(records=dict(type='file', path=path, split='xml', split_tag='record')),
+        dict(type='xpath'),
+        columns,
+        dict(records=list(columns)),
+    )
+    return batch.run_once
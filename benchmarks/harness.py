@@ -0,0 +1,50 @@
+import statistics
+import time
+from fnmatch import fnmatch
+from typing import Any, Callable
+
+
+BENCHMARKS: dict[str, tuple[Callable[[], Callable[[], Any]], int]] = {}
+
+
+def benchmark(name: str, items: int = 1):
+    def bind(setup: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = (setup, items)
+        return setup
+    return bind
+
+
+def select(patterns: list[str]) -> list[str]:
+    return [name for name in BENCHMARKS if not patterns or any(fnmatch(name, p) for p in patterns)]
+
+
+def measure(name: str, repeat: int = 5, min_seconds: float = 0.2) -> dict[str, Any]:
+    setup, items = BENCHMARKS[name]
+    run = setup()
+    run()
+    number, elapsed = 1, 0.0
+    # calibrate number of runs per sample so that short benchmarks are not dominated by timer resolution
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds / repeat or number >= 1_000_000:
+            break
+        number *= 10
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - started) / number)
+    best = min(samples)
+    return {
+        'name': name,
+        'items': items,
+        'number': number,
+        'repeat': repeat,
+        'seconds_min': best,
+        'seconds_median': statistics.median(samples),
+        'items_per_sec': items / best if best else None,
+    }
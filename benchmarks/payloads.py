@@ -0,0 +1,65 @@
+import json
+import random
+from typing import Any
+from xml.sax.saxutils import escape
+
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa')
+
+
+def _scalar(rng: random.Random) -> Any:
+    kind = rng.randrange(4)
+    if kind == 0:
+        return rng.randrange(1_000_000)
+    elif kind == 1:
+        return round(rng.random() * 1000, 3)
+    elif kind == 2:
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    return rng.random() > 0.5
+
+
+def record(rng: random.Random, width: int, depth: int) -> dict[str, Any]:
+    rec = {f'f{i}': _scalar(rng) for i in range(width)}
+    if depth > 0:
+        rec['items'] = [record(rng, width, depth - 1) for _ in range(width)]
+    return rec
+
+
+def json_payload(seed: int = 0, width: int = 5, depth: int = 2) -> bytes:
+    return json.dumps(record(random.Random(seed), width, depth)).encode('utf8')
+
+
+def json_array(seed: int = 0, records: int = 1000, width: int = 5, depth: int = 1) -> bytes:
+    rng = random.Random(seed)
+    return json.dumps([record(rng, width, depth) for _ in range(records)]).encode('utf8')
+
+
+def ndjson(seed: int = 0, records: int = 1000, width: int = 5, depth: int = 1) -> bytes:
+    rng = random.Random(seed)
+    return '\n'.join(json.dumps(record(rng, width, depth)) for _ in range(records)).encode('utf8')
+
+
+def _xml(rec: dict[str, Any], tag: str) -> str:
+    inner = ''.join(
+        ''.join(_xml(item, 'item') for item in value) if key == 'items' else f'<{key}>{escape(str(value))}</{key}>'
+        for key, value in rec.items()
+    )
+    return f'<{tag}>{inner}</{tag}>'
+
+
+def xml_payload(seed: int = 0, width: int = 5, depth: int = 2) -> bytes:
+    return _xml(record(random.Random(seed), width, depth), 'record').encode('utf8')
+
+
+def xml_feed(seed: int = 0, records: int = 1000, width: int = 5, depth: int = 1) -> bytes:
+    rng = random.Random(seed)
+    return ('<feed>' + ''.join(_xml(record(rng, width, depth), 'record') for _ in range(records)) + '</feed>').encode()
+
+
+def log_lines(seed: int = 0, lines: int = 1000) -> bytes:
+    rng = random.Random(seed)
+    return '\n'.join(
+        f'2020-01-01T00:{i // 60 % 60:02}:{i % 60:02} level={rng.choice(("info", "warn", "error"))} '
+        f'user={rng.choice(WORDS)} took={rng.randrange(1000)}ms msg="{_scalar(rng)}"'
+        for i in range(lines)
+    ).encode('utf8')
@@ -0,0 +1,123 @@
+from batchout import Batch
+from batchout.core.data import Data
+from batchout.core.registry import Registry
+from batchout.std import Extractor
+from batchout.std.inputs.mixin import JsonSplitter, NdjsonSplitter, XmlSplitter
+
+from . import payloads
+from .harness import benchmark
+
+
+def _extract(extractor_config, payload, paths):
+    extractor = Registry.create(Extractor, extractor_config)
+
+    def run():
+        # releasing the payload drops what extractors cached for it, so every run parses it again
+        extractor.extract_values(paths, payload)
+        extractor.release(payload)
+    return run
+
+
+JSON_PATHS = [f'f{i}' for i in range(5)] + [f'items[{j}].items[{k}].f0' for j in range(5) for k in range(5)]
+XML_PATHS = [f'/record/f{i}/text()' for i in range(5)] + [
+    f'/record/item[{j}]/item[{k}]/f0/text()' for j in range(1, 6) for k in range(1, 6)
+]
+REGEX_PATHS = [r'level=(\w+)', r'user=(\w+)', r'took=(\d+)ms']
+
+
+@benchmark('extract.jsonpath', items=len(JSON_PATHS))
+def extract_jsonpath():
+    return _extract(dict(type='jsonpath'), payloads.json_payload(width=5, depth=2), JSON_PATHS)
+
+
+@benchmark('extract.jsonpath_fast', items=len(JSON_PATHS))
+def extract_jsonpath_fast():
+    return _extract(dict(type='jsonpath_fast'), payloads.json_payload(width=5, depth=2), JSON_PATHS)
+
+
+@benchmark('extract.xpath', items=len(XML_PATHS))
+def extract_xpath():
+    return _extract(dict(type='xpath'), payloads.xml_payload(width=5, depth=2), XML_PATHS)
+
+
+@benchmark('extract.regex', items=len(REGEX_PATHS))
+def extract_regex():
+    return _extract(dict(type='regex', group=1), payloads.log_lines(lines=100), REGEX_PATHS)
+
+
+@benchmark('extract.regex_bytes', items=len(REGEX_PATHS))
+def extract_regex_bytes():
+    return _extract(dict(type='regex', group=1, decode_bytes=False), payloads.log_lines(lines=100), REGEX_PATHS)
+
+
+def _rows(n):
+    return [(i, i * 0.5, i % 2 == 0, f'row{i}') for i in range(n)]
+
+
+@benchmark('data.with_row', items=10_000)
+def data_with_row():
+    rows = _rows(10_000)
+
+    def run():
+        data = Data('i', 'f', 'b', 's', i='integer', f='float', b='boolean', s='string')
+        for row in rows:
+            data.with_row('source', row)
+    return run
+
+
+@benchmark('data.flush', items=10_000)
+def data_flush():
+    rows = _rows(10_000)
+
+    def run():
+        data = Data('i', 'f', 'b', 's', i='integer', f='float', b='boolean', s='string')
+        data.with_row('source', *rows)
+        data.cursor
+        data.reset()
+    return run
+
+
+@benchmark('batch.parse', items=5 * 5 * 6)
+def batch_parse():
+    batch = Batch.from_config(dict(
+        extractors=dict(jp=dict(type='jsonpath_fast', strategy='take_first')),
+        indexes=dict(
+            outer=dict(type='for_list', path='items'),
+            inner=dict(type='for_list', path='items[{outer}].items'),
+            fields=dict(type='for_object', path='items[{outer}].items[{inner}]'),
+        ),
+        columns=dict(value=dict(type='string', path='items[{outer}].items[{inner}].f0')),
+        maps=dict(payloads=[{'outer': [{'inner': ['value', {'fields': []}]}]}]),
+    ), defaults=dict(indexes=dict(extractor='jp'), columns=dict(extractor='jp')))
+    batch._validate_components()
+    payload = payloads.json_payload(width=5, depth=2)
+
+    def run():
+        for _ in batch._parse(payload, 'payloads'):
+            pass
+        batch._extractors['jp'].release(payload)
+    return run
+
+
+def _split(splitter, data, block=64 * 1024):
+    def run():
+        each = splitter()
+        for pos in range(0, len(data), block):
+            each.feed(data[pos:pos + block])
+        each.close()
+    return run
+
+
+@benchmark('split.json', items=1000)
+def split_json():
+    return _split(JsonSplitter, payloads.json_array(records=1000))
+
+
+@benchmark('split.ndjson', items=1000)
+def split_ndjson():
+    return _split(NdjsonSplitter, payloads.ndjson(records=1000))
+
+
+@benchmark('split.xml', items=1000)
+def split_xml():
+    return _split(lambda: XmlSplitter('record'), payloads.xml_feed(records=1000))
@@ -11,7 +11,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/ilia-khaustov/batchout",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=('benchmarks', 'benchmarks.*', 'tests', 'tests.*')),
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
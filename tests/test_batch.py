@@ -1,14 +1,26 @@
+import gzip
 import json
 import logging
 import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Any
+from urllib.parse import parse_qsl, urlsplit
 import os.path
 
 import pytest
 
-from batchout import Batch, Output
+from batchout import Batch, Column, Extractor, FetchRetryable, Input, Output, StringColumn
 from batchout.core.registry import Registry
 from batchout.core.config import with_config_key
+from batchout.ext.jsonpath import extractors as jsonpath_extractors
+from batchout.ext.xpath.extractors import XPathExtractorConfigInvalid
+from batchout.std.extractors.mixin import WithStrategy
+from batchout.std.inputs.http import HttpInputBadResponse, HttpInputConfigInvalid
+from batchout.std.inputs.mixin import JsonSplitter, RateLimitConfigInvalid, WithRateLimit
 
 tests_dir = os.path.dirname(__file__)
 
@@ -22,6 +34,28 @@ def configure_logging():
     )
 
 
+class QuietHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *_):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    servers = []
+
+    def serve(handler: type[BaseHTTPRequestHandler]) -> str:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}/'
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
 @Registry.bind(Output, 'recorder')
 class OutputRecorder(Output):
 
@@ -85,7 +119,8 @@ def json_orders():
     return g
 
 
-def test_run_for_json(json_orders):
+@pytest.mark.parametrize('extractor_type', ['jsonpath', 'jsonpath_fast'])
+def test_run_for_json(json_orders, extractor_type):
     b = Batch.from_config(dict(
         inputs=dict(
             json_orders=dict(
@@ -105,7 +140,7 @@ def test_run_for_json(json_orders):
         ),
         extractors=dict(
             first_match_in_json=dict(
-                type='jsonpath',
+                type=extractor_type,
             ),
         ),
         columns=dict(
@@ -431,3 +466,933 @@ def test_run_for_nested_indexing():
         config = json.loads(f.read())
     defaults = config.pop('defaults') if 'defaults' in config else {}
     Batch.from_config(config, defaults).run_once()
+
+
+def test_native_types_in_selector():
+    b = Batch.from_config(dict(
+        inputs=dict(
+            events=dict(
+                type='const',
+                data=[
+                    json.dumps({'n': n, 'ok': n % 2, 'ts': f'2020-01-{n:02}T00:00:00'})
+                    for n in (10, 9, 2)
+                ],
+            ),
+        ),
+        extractors=dict(
+            first_match_in_json=dict(
+                type='jsonpath',
+            ),
+        ),
+        columns=dict(
+            n=dict(type='integer', path='n'),
+            ok=dict(type='boolean', path='ok'),
+            ts=dict(type='datetime', path='ts'),
+        ),
+        maps=dict(
+            events=['n', 'ok', 'ts'],
+        ),
+        outputs=dict(
+            recorder=dict(
+                type='recorder'
+            ),
+        ),
+        selectors=dict(
+            recent=dict(
+                type='sql',
+                query="select n, ok, ts, typeof(n) from events where n > 5 order by ts",
+                columns=['n', 'ok', 'ts', 'n_type'],
+            ),
+        ),
+        tasks=dict(
+            read_events=dict(
+                type='reader',
+                inputs=['events'],
+            ),
+            record=dict(
+                type='writer',
+                selector='recent',
+                outputs=['recorder'],
+            ),
+        )
+    ), defaults={
+        'columns': {
+            'extractor': 'first_match_in_json',
+        },
+    })
+    b.run_once()
+    assert b._outputs['recorder'].rows == [
+        (9, True, datetime(2020, 1, 9, tzinfo=timezone.utc), 'integer'),
+        (10, False, datetime(2020, 1, 10, tzinfo=timezone.utc), 'integer'),
+    ]
+
+
+def test_max_index_combinations_per_payload():
+    config_path = os.path.join(tests_dir, 'config/nested_indexing.json')
+    with open(config_path) as f:
+        config = json.loads(f.read())
+    defaults = config.pop('defaults')
+    config['tasks'] = {'read_departments': dict(config['tasks']['read_departments'], max_index_combinations=3)}
+    b = Batch.from_config(config, defaults).run_once()
+    assert b.last.count('departments') == 3
+
+
+@pytest.mark.parametrize('max_memoized', [0, 3, 100000])
+def test_memoized_index_combinations_bounded(max_memoized, monkeypatch):
+    context = {
+        'a': {a: {'b': {b: {} for b in range(3)}, 'c': {c: {'d': {d: {} for d in range(2)}} for c in range(4)}}
+              for a in range(2)},
+        'e': {e: {} for e in range(2)},
+    }
+    expected = [dict(indexes) for indexes in Batch._build_indexes(context)]
+    monkeypatch.setattr('batchout.core.batch.MAX_MEMOIZED_COMBINATIONS', max_memoized)
+    assert [dict(indexes) for indexes in Batch._build_indexes(context)] == expected
+    assert [dict(indexes) for indexes in Batch._build_indexes(context, 5)][:5] == expected[:5]
+
+
+def test_regex_on_bytes():
+    b = Batch.from_config(dict(
+        inputs=dict(
+            log=dict(
+                type='const',
+                data=['level=info user=ana took=12ms', 'level=error user=jörg took=7ms'],
+            ),
+        ),
+        extractors=dict(
+            regex_bytes=dict(
+                type='regex',
+                decode_bytes=False,
+                group=1,
+            ),
+        ),
+        columns=dict(
+            level=dict(type='string', path=r'level=(\w+)'),
+            user=dict(type='string', path=r'user=(\S+)'),
+            took=dict(type='integer', path=r'took=(\d+)ms'),
+        ),
+        maps=dict(
+            log=['level', 'user', 'took'],
+        ),
+        outputs=dict(
+            recorder=dict(
+                type='recorder'
+            ),
+        ),
+        selectors=dict(
+            all_lines=dict(
+                type='sql',
+                query='select level, user, took from log order by took',
+                columns=['level', 'user', 'took'],
+            ),
+        ),
+        tasks=dict(
+            read_log=dict(
+                type='reader',
+                inputs=['log'],
+            ),
+            record=dict(
+                type='writer',
+                selector='all_lines',
+                outputs=['recorder'],
+            ),
+        )
+    ), defaults={
+        'columns': {
+            'extractor': 'regex_bytes',
+        },
+    })
+    b.run_once()
+    assert b._outputs['recorder'].rows == [('error', 'jörg', 7), ('info', 'ana', 12)]
+
+
+def test_payload_cache_eviction_and_release():
+    extractor = Registry.create(Extractor, dict(type='jsonpath'))
+    payloads = [json.dumps({'order': {'id': i, 'items': [{'sku': i}]}}).encode() for i in range(40)]
+    for i, payload in enumerate(payloads):
+        assert extractor.extract_value('order.id', payload) == i
+    assert len(extractor._payload_cache) == extractor.payload_cache_size
+    assert id(payloads[0]) not in extractor._payload_cache and id(payloads[-1]) in extractor._payload_cache
+    # nested paths continue from parent nodes resolved for the same payload
+    nodes = extractor._cache_for(payloads[-1])['nodes']
+    parent = nodes['order']
+    assert extractor.extract_value('order.items[0].sku', payloads[-1]) == 39
+    assert nodes['order'] is parent and 'order.items[0]' in nodes
+    extractor.release(payloads[-1])
+    assert id(payloads[-1]) not in extractor._payload_cache
+    assert extractor._payload_cache_bytes == sum(len(payload) for payload, _ in extractor._payload_cache.values())
+    extractor.release(payloads[-1])
+    assert extractor.extract_value('order.items[0].sku', payloads[-1]) == 39
+
+
+@pytest.mark.parametrize('config,paths,payload', [
+    (dict(type='jsonpath'), ['order.id', 'order.items[1].sku', 'order.missing', '$..sku'],
+     b'{"order": {"id": 1, "items": [{"sku": "a"}, {"sku": "b"}]}}'),
+    (dict(type='jsonpath_fast'), ['order.id', 'order.items[1].sku', 'order.missing', '$..sku'],
+     b'{"order": {"id": 1, "items": [{"sku": "a"}, {"sku": "b"}]}}'),
+    (dict(type='xpath', strategy='take_all'), ['/order/@id', '//sku/text()', '/order/missing', '//sku['],
+     b'<order id="1"><sku>a</sku><sku>b</sku></order>'),
+    (dict(type='regex', group=1), [r'id=(\d+)', r'sku=(\w+)', r'missing=(\w+)', r'(\w+)=a'],
+     b'id=1 sku=a sku=b'),
+])
+def test_extract_values_same_as_per_path(config, paths, payload):
+    extractor = Registry.create(Extractor, config)
+    expected = [Registry.create(Extractor, dict(config)).extract(path, payload) for path in paths]
+    assert extractor.extract_many(paths, payload) == expected
+    assert extractor.extract_values(paths, payload) == [value for _, value in expected]
+    assert [extractor.extract_value(path, payload) for path in paths] == [value for _, value in expected]
+
+
+@Registry.bind(Column, 'upper')
+class ColumnUpper(StringColumn):
+
+    def value(self, extractor, payload, **indexes):
+        v = super().value(extractor, payload, **indexes)
+        return v and v.upper()
+
+
+def test_overridden_column_value_is_called():
+    b = Batch.from_config(dict(
+        inputs=dict(names=dict(type='const', data=['{"name": "x", "id": 1}'])),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        columns=dict(
+            name=dict(type='upper', path='name', extractor='first_match_in_json'),
+            id=dict(type='integer', path='id', extractor='first_match_in_json'),
+        ),
+        maps=dict(names=['name', 'id']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(all_names=dict(type='sql', query='select name, id from names', columns=['name', 'id'])),
+        tasks=dict(
+            read_names=dict(type='reader', inputs=['names']),
+            record=dict(type='writer', selector='all_names', outputs=['recorder']),
+        ),
+    ))
+    b.run_once()
+    assert b._outputs['recorder'].rows == [('X', 1)]
+
+
+def test_xpath_cache_max_bytes():
+    payloads = [b'<order id="%d"/>' % i for i in range(3)]
+    extractor = Registry.create(Extractor, dict(type='xpath', cache_max_bytes=2 * len(payloads[0])))
+    roots = [extractor._get_root(payload) for payload in payloads]
+    # oldest tree is parsed again once payloads exceed the limit, newer ones are reused
+    assert extractor._get_root(payloads[2]) is roots[2]
+    assert extractor._get_root(payloads[0]) is not roots[0]
+    assert extractor._payload_cache_bytes == 2 * len(payloads[0])
+    assert [extractor.extract_value('/order/@id', payload) for payload in payloads] == ['0', '1', '2']
+    # a payload over the limit is still cached while it is being extracted from
+    large = b'<order id="%s"/>' % (b'1' * 100)
+    root = extractor._get_root(large)
+    assert extractor._get_root(large) is root and len(extractor._payload_cache) == 1
+    unlimited = Registry.create(Extractor, dict(type='xpath', cache_max_bytes=0))
+    roots = [unlimited._get_root(payload) for payload in payloads + [large]]
+    assert [unlimited._get_root(payload) for payload in payloads + [large]] == roots
+    with pytest.raises(XPathExtractorConfigInvalid):
+        Registry.create(Extractor, dict(type='xpath', cache_max_bytes=-1))
+
+
+@pytest.mark.parametrize('strategy,expected', [
+    ('take_first', ('p0', None)),
+    ('take_first_not_null', ('p1', 1)),
+    ('take_last', ('p3', None)),
+    ('take_last_not_null', ('p2', 2)),
+    ('take_all', (('p0', 'p1', 'p2', 'p3'), (None, 1, 2, None))),
+])
+def test_paths_built_for_kept_matches_only(strategy, expected):
+    built = []
+
+    def path_of(match):
+        built.append(match)
+        return f'p{match}'
+
+    matches = list(enumerate([None, 1, 2, None]))
+    extractor = WithStrategy()
+    extractor.set_strategy(dict(strategy=strategy))
+    assert extractor._apply_strategy(iter(matches), path_of) == expected
+    assert built == ([0, 1, 2, 3] if strategy == 'take_all' else [int(expected[0][1:])])
+
+
+def test_extract_values_builds_no_paths(monkeypatch):
+    built = []
+    monkeypatch.setattr(jsonpath_extractors, '_full_path', lambda datum: built.append(datum) or str(datum.full_path))
+    extractor = Registry.create(Extractor, dict(type='jsonpath', strategy='take_last'))
+    payload = b'{"items": [{"id": 1}, {"id": 2}]}'
+    assert extractor.extract_values(['items[*].id'], payload) == [2]
+    assert built == []
+    assert extractor.extract('items[*].id', payload) == ('items.[1].id', 2)
+    assert len(built) == 1
+
+
+def test_split_xml_file(xml_orders, tmp_path):
+    feed_path = tmp_path / 'orders.xml'
+    feed_path.write_text('<feed xmlns:x="urn:x">' + ''.join(xml_orders(3)) + '</feed>')
+    b = Batch.from_config(dict(
+        inputs=dict(
+            orders=dict(
+                type='file',
+                path=str(feed_path),
+                split='xml',
+                split_tag='order',
+            ),
+        ),
+        extractors=dict(
+            first_match_in_xml=dict(
+                type='xpath',
+            ),
+        ),
+        columns=dict(
+            order_id=dict(type='integer', path='/order/@id'),
+            products=dict(type='integer', path='count(/order/cart/product)'),
+        ),
+        maps=dict(
+            orders=['order_id', 'products'],
+        ),
+        outputs=dict(
+            recorder=dict(
+                type='recorder'
+            ),
+        ),
+        selectors=dict(
+            all_orders=dict(
+                type='sql',
+                query='select order_id, products from orders order by order_id',
+                columns=['order_id', 'products'],
+            ),
+        ),
+        tasks=dict(
+            read_orders=dict(
+                type='reader',
+                inputs=['orders'],
+            ),
+            record=dict(
+                type='writer',
+                selector='all_orders',
+                outputs=['recorder'],
+            ),
+        )
+    ), defaults={
+        'columns': {
+            'extractor': 'first_match_in_xml',
+        },
+    })
+    b.run_once()
+    assert b._outputs['recorder'].rows == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_split_json_file(json_orders, tmp_path):
+    feed_path = tmp_path / 'orders.json'
+    feed_path.write_text('[' + ','.join(json_orders(3)) + ']')
+    b = Batch.from_config(dict(
+        inputs=dict(
+            orders=dict(
+                type='file',
+                path=str(feed_path),
+                split='json',
+            ),
+        ),
+        extractors=dict(
+            first_match_in_json=dict(
+                type='jsonpath',
+            ),
+        ),
+        columns=dict(
+            order_id=dict(type='integer', path='order.id'),
+            last_price=dict(type='integer', path='cart[-1:].price'),
+        ),
+        maps=dict(
+            orders=['order_id', 'last_price'],
+        ),
+        outputs=dict(
+            recorder=dict(
+                type='recorder'
+            ),
+        ),
+        selectors=dict(
+            all_orders=dict(
+                type='sql',
+                query='select order_id, last_price from orders order by order_id',
+                columns=['order_id', 'last_price'],
+            ),
+        ),
+        tasks=dict(
+            read_orders=dict(
+                type='reader',
+                inputs=['orders'],
+            ),
+            record=dict(
+                type='writer',
+                selector='all_orders',
+                outputs=['recorder'],
+            ),
+        )
+    ), defaults={
+        'columns': {
+            'extractor': 'first_match_in_json',
+        },
+    })
+    b.run_once()
+    assert b._outputs['recorder'].rows == [(1, 10), (2, 30), (3, 50)]
+
+
+@pytest.mark.parametrize('block', [
+    1,
+    # block boundary right after the dot and the exponent mark of a float
+    len('[{"id": 1}, 12345.'),
+    len('[{"id": 1}, 12345.5, -2.5e'),
+])
+def test_split_json_across_blocks(block):
+    data = '[{"id": 1}, 12345.5, -2.5e-3, "a,]b", [1, [2]], true, null, 7]'.encode()
+    splitter = JsonSplitter()
+    records = []
+    for start in range(0, len(data), block):
+        records.extend(splitter.feed(data[start:start + block]))
+    records.extend(splitter.close())
+    assert [json.loads(r) for r in records] == json.loads(data)
+
+
+def test_stats_per_component():
+    config_path = os.path.join(tests_dir, 'config/nested_indexing.json')
+    with open(config_path) as f:
+        config = json.loads(f.read())
+    defaults = config.pop('defaults')
+    b = Batch.from_config(config, defaults)
+    assert b.run_once().stats is None
+    b = b.with_stats().run_once()
+    assert b.stats.get('input', 'departments', 'parse')['rows'] == b.last.count('departments')
+    assert b.stats.get('input', 'departments', 'fetch')['bytes'] > 0
+    assert {e['role'] for e in b.stats.entries()} >= {'input', 'index', 'extractor', 'column', 'data'}
+    assert json.loads(b.stats.to_json())['seconds'] > 0
+
+
+def test_metrics_per_run():
+    config_path = os.path.join(tests_dir, 'config/nested_indexing.json')
+    with open(config_path) as f:
+        config = json.loads(f.read())
+    defaults = config.pop('defaults')
+    b = Batch.from_config(config, defaults).with_metrics()
+    b.run_once().run_once()
+    assert b.stats is None
+    assert b.metrics.get('batchout_batches_total') == 2
+    assert b.metrics.get('batchout_batch_duration_seconds') == 2
+    assert b.metrics.get('batchout_rows_total', role='input', name='departments', stage='parse') == \
+        2 * b.last.count('departments')
+    assert b.metrics.get('batchout_fetch_duration_seconds', input='departments') > 0
+    rendered = b.metrics.render()
+    assert '# TYPE batchout_batch_duration_seconds histogram' in rendered
+    assert 'batchout_batch_duration_seconds_bucket{le="+Inf"} 2' in rendered
+
+
+def test_progress_instead_of_line_per_read(caplog):
+    config_path = os.path.join(tests_dir, 'config/nested_indexing.json')
+    with open(config_path) as f:
+        config = json.loads(f.read())
+    defaults = config.pop('defaults')
+    config['tasks']['read_departments']['progress_sec'] = 60
+    with caplog.at_level(logging.INFO, logger='batchout.core.batch'):
+        b = Batch.from_config(config, defaults).run_once()
+    messages = [r.getMessage() for r in caplog.records]
+    assert not any('new total is' in m for m in messages)
+    progress = [m for m in messages if 'read_departments: 1/1 reads (100%)' in m]
+    assert len(progress) == 1
+    assert f'{b.last.count("departments")} records, 0 errors, ETA 0s' in progress[0]
+
+
+@Registry.bind(Input, 'echo')
+class InputEcho(Input):
+
+    def __init__(self, _):
+        self._done = False
+
+    def fetch(self, **params):
+        if self._done:
+            return None
+        self._done = True
+        return json.dumps(params).encode()
+
+    def commit(self):
+        pass
+
+    def reset(self):
+        self._done = False
+
+
+def test_adaptive_threads():
+    b = Batch.from_config(dict(
+        inputs=dict(
+            ids=dict(type='const', data=[json.dumps([{'id': i} for i in range(1, 51)])]),
+            echo=dict(type='echo'),
+        ),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        indexes=dict(idx=dict(type='for_list', path='$')),
+        columns=dict(
+            id=dict(type='integer', path='$[{idx}].id'),
+            echoed=dict(type='integer', path='id'),
+        ),
+        maps=dict(ids=[{'idx': ['id']}], echo=['echoed']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(
+            ids=dict(type='sql', query='select id from ids', columns=['id']),
+            echoed=dict(type='sql', query='select echoed from echo order by echoed', columns=['echoed']),
+        ),
+        tasks=dict(
+            read_ids=dict(type='reader', inputs=['ids']),
+            read_echo=dict(type='reader', selector='ids', inputs=['echo'], threads=8, min_threads=1),
+            record=dict(type='writer', selector='echoed', outputs=['recorder']),
+        ),
+    ), defaults={
+        'indexes': {'extractor': 'first_match_in_json'},
+        'columns': {'extractor': 'first_match_in_json'},
+    })
+    # ids read by the first batch are echoed in the second one
+    b.run_once().run_once()
+    assert b._outputs['recorder'].rows == [(i,) for i in range(1, 51)]
+    assert 1 < b._limits['read_echo'].limit <= 8
+
+
+def test_rate_limit_shared_by_clones(http_server):
+    class Handler(QuietHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+    url = http_server(Handler)
+    config = dict(type='http', url=url, rate_per_sec=20, rate_burst=2)
+    master = Registry.create(Input, dict(config))
+    clones = [Registry.create(Input, dict(config)) for _ in range(4)]
+    for clone in clones:
+        clone.share_state(master)
+    started = time.perf_counter()
+    assert [c.fetch() for c in clones] == [b'{}'] * 4
+    assert time.perf_counter() - started >= 0.09
+    assert sum(c.counters()['rate_waits'] for c in clones) == 2
+    # another input with the same config has a bucket of its own
+    assert Registry.create(Input, dict(config)).fetch() == b'{}'
+    assert time.perf_counter() - started < 0.2
+
+
+
+def test_host_rate_limit_shared_within_batch():
+    def batch(**limits):
+        return Batch.from_config(dict(
+            inputs=dict(
+                users=dict(type='http', url='http://api.local/users', host_rate_per_sec=10),
+                orders=dict(type='http', url='http://API.local/orders', **limits),
+            ),
+            tasks=dict(read=dict(type='reader', inputs=['users', 'orders'])),
+        ))
+
+    b = batch(host_rate_per_sec=10)
+    b._validate_components()
+    users, orders = b._inputs['users'], b._inputs['orders']
+    assert users._rate_buckets('api.local') == orders._rate_buckets('api.local')
+    # another batch has buckets of its own
+    other = batch(host_rate_per_sec=10)
+    other._validate_components()
+    assert other._inputs['users']._rate_buckets('api.local') != users._rate_buckets('api.local')
+    with pytest.raises(RateLimitConfigInvalid):
+        batch(host_rate_per_sec=5).run_once()
+
+
+@Registry.bind(Input, 'throttled')
+class InputThrottled(WithRateLimit, InputEcho):
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._init_rate_limit(config)
+
+    def fetch(self, **params):
+        if not self._done:
+            self._wait_for_rate()
+        return super().fetch(**params)
+
+    def counters(self):
+        return {'rate_waits': self._rate_waits}
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_rate_limit_waits_in_reader(threads):
+    b = Batch.from_config(dict(
+        inputs=dict(
+            ids=dict(type='const', data=[json.dumps([{'id': i} for i in range(1, 11)])]),
+            throttled=dict(type='throttled', rate_per_sec=50, rate_burst=1),
+        ),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        indexes=dict(idx=dict(type='for_list', path='$')),
+        columns=dict(
+            id=dict(type='integer', path='$[{idx}].id'),
+            echoed=dict(type='integer', path='id'),
+        ),
+        maps=dict(ids=[{'idx': ['id']}], throttled=['echoed']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(
+            ids=dict(type='sql', query='select id from ids', columns=['id']),
+            echoed=dict(type='sql', query='select echoed from throttled order by echoed', columns=['echoed']),
+        ),
+        tasks=dict(
+            read_ids=dict(type='reader', inputs=['ids']),
+            read_throttled=dict(type='reader', selector='ids', inputs=['throttled'], threads=threads),
+            record=dict(type='writer', selector='echoed', outputs=['recorder']),
+        ),
+    ), defaults={
+        'indexes': {'extractor': 'first_match_in_json'},
+        'columns': {'extractor': 'first_match_in_json'},
+    }).with_stats()
+    b.run_once()
+    started = time.perf_counter()
+    b.run_once()
+    assert time.perf_counter() - started >= 0.15
+    assert b._outputs['recorder'].rows == [(i,) for i in range(1, 11)]
+    # reads are delayed by the reader, no thread sleeps waiting for a token
+    assert b.stats.get('task', 'read_throttled', 'rate_wait')['calls'] >= 5
+    assert b.stats.get('input', 'throttled', 'rate_waits')['calls'] == 0
+
+
+@Registry.bind(Input, 'flaky')
+class InputFlaky(InputEcho):
+    failed = set()
+
+    def fetch(self, **params):
+        if params and params['id'] not in self.failed:
+            self.failed.add(params['id'])
+            raise FetchRetryable('try again later', retries=1, max_backoff_sec=0)
+        return super().fetch(**params)
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_retries_scheduled_by_reader(threads):
+    InputFlaky.failed.clear()
+    b = Batch.from_config(dict(
+        inputs=dict(
+            ids=dict(type='const', data=[json.dumps([{'id': i} for i in range(1, 11)])]),
+            flaky=dict(type='flaky'),
+        ),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        indexes=dict(idx=dict(type='for_list', path='$')),
+        columns=dict(
+            id=dict(type='integer', path='$[{idx}].id'),
+            echoed=dict(type='integer', path='id'),
+        ),
+        maps=dict(ids=[{'idx': ['id']}], flaky=['echoed']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(
+            ids=dict(type='sql', query='select id from ids', columns=['id']),
+            echoed=dict(type='sql', query='select echoed from flaky order by echoed', columns=['echoed']),
+        ),
+        tasks=dict(
+            read_ids=dict(type='reader', inputs=['ids']),
+            read_flaky=dict(type='reader', selector='ids', inputs=['flaky'], threads=threads),
+            record=dict(type='writer', selector='echoed', outputs=['recorder']),
+        ),
+    ), defaults={
+        'indexes': {'extractor': 'first_match_in_json'},
+        'columns': {'extractor': 'first_match_in_json'},
+    }).with_stats()
+    b.run_once().run_once()
+    assert b._outputs['recorder'].rows == [(i,) for i in range(1, 11)]
+    assert b.stats.get('task', 'read_flaky', 'retry')['calls'] == 10
+
+
+def test_http_cache_revalidated_with_etag(tmp_path, http_server):
+    requests = []
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            requests.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', '9')
+            self.end_headers()
+            self.wfile.write(b'{"v": 1}\n')
+
+    url = http_server(Handler)
+    config = dict(type='http', url=url, cache_dir=str(tmp_path))
+    # response is cached only once input commits
+    uncommitted = Registry.create(Input, dict(config))
+    assert uncommitted.fetch() == b'{"v": 1}\n'
+    uncommitted.reset()
+    uncommitted.commit()
+    first = Registry.create(Input, dict(config))
+    assert first.fetch() == b'{"v": 1}\n'
+    first.commit()
+    cached = Registry.create(Input, dict(config))
+    assert cached.fetch() == b'{"v": 1}\n'
+    assert cached.counters()['not_modified'] == 1
+    assert Registry.create(Input, dict(config, cache_unchanged='skip')).fetch() is None
+    assert Registry.create(Input, dict(config, split='ndjson')).fetch() == b'{"v": 1}'
+    assert requests == [None, None, '"v1"', '"v1"', '"v1"']
+    assert Registry.create(Input, dict(config, cache_ttl_sec=60)).fetch() == b'{"v": 1}\n'
+    assert len(requests) == 5
+
+
+@Registry.bind(Output, 'failing_once')
+class OutputFailingOnce(OutputRecorder):
+    failed = False
+
+    def ingest(self, cols, rows):
+        if not OutputFailingOnce.failed:
+            OutputFailingOnce.failed = True
+            raise RuntimeError('output is not available')
+        super().ingest(cols, rows)
+
+
+def test_http_cache_published_after_outputs(tmp_path, http_server):
+    class Handler(QuietHandler):
+        def do_GET(self):
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', '9')
+            self.end_headers()
+            self.wfile.write(b'{"v": 1}\n')
+
+    OutputFailingOnce.failed = False
+    b = Batch.from_config(dict(
+        inputs=dict(versions=dict(
+            type='http', url=http_server(Handler), cache_dir=str(tmp_path), cache_unchanged='skip',
+        )),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        columns=dict(v=dict(type='integer', path='v', extractor='first_match_in_json')),
+        maps=dict(versions=['v']),
+        outputs=dict(failing=dict(type='failing_once')),
+        selectors=dict(all_versions=dict(type='sql', query='select v from versions', columns=['v'])),
+        tasks=dict(
+            read_versions=dict(type='reader', inputs=['versions']),
+            write_versions=dict(type='writer', selector='all_versions', outputs=['failing']),
+        ),
+    ))
+    with pytest.raises(RuntimeError):
+        b.run_once()
+    # response of the failed batch was not cached, so it is read again instead of being skipped
+    b.run_once()
+    assert b._outputs['failing'].rows == [(1,)]
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.tmp-')]
+    b.run_once()
+    assert b.last.count('versions') == 0
+
+
+def test_dedup_identical_payloads(tmp_path):
+    feed_path = tmp_path / 'orders.ndjson'
+    feed_path.write_text('\n'.join(json.dumps({'order': {'id': i}}) for i in (1, 2, 3)))
+    config = dict(
+        inputs=dict(orders=dict(type='file', path=str(feed_path), split='ndjson', dedup=True)),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        columns=dict(order_id=dict(type='integer', path='order.id')),
+        maps=dict(orders=['order_id']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(
+            all_orders=dict(type='sql', query='select order_id from orders order by order_id', columns=['order_id']),
+        ),
+        tasks=dict(
+            read_orders=dict(type='reader', inputs=['orders']),
+            record=dict(type='writer', selector='all_orders', outputs=['recorder']),
+        )
+    )
+    defaults = {'columns': {'extractor': 'first_match_in_json'}}
+    b = Batch.from_config(config, defaults=defaults).with_stats()
+    b.run_once()
+    assert b._outputs['recorder'].rows == [(1,), (2,), (3,)]
+    feed_path.write_text('\n'.join(json.dumps({'order': {'id': i}}) for i in (1, 2, 3, 4)))
+    b.run_once()
+    assert b._outputs['recorder'].rows == [(4,)]
+    assert b.stats.get('input', 'orders', 'skip')['calls'] == 3
+    # hashes belong to inputs of a batch, another batch with the same config reads everything
+    other = Batch.from_config(config, defaults=defaults)
+    other.run_once()
+    assert other._outputs['recorder'].rows == [(1,), (2,), (3,), (4,)]
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'deflate', 'raw-deflate'])
+def test_http_compressed_response(encoding, http_server):
+    body = b''.join(b'{"i": %d}\n' % i for i in range(10000))
+    if encoding == 'gzip':
+        encoded = gzip.compress(body)
+    else:
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS if encoding == 'deflate' else -zlib.MAX_WBITS)
+        encoded = compressor.compress(body) + compressor.flush()
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            assert self.headers.get('Accept-Encoding') == 'gzip, deflate'
+            self.send_response(200)
+            self.send_header('Content-Encoding', encoding.replace('raw-', ''))
+            self.send_header('Content-Length', str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+    url = http_server(Handler)
+    config = dict(type='http', url=url)
+    assert Registry.create(Input, dict(config)).fetch() == body
+    records = Registry.create(Input, dict(config, split='ndjson'))
+    assert list(iter(records.fetch, None)) == body.splitlines()
+
+
+@pytest.mark.parametrize('chunks', [
+    dict(chunk_endswith='\n'),
+    dict(chunk_endswith='\n', compression=True),
+    dict(chunk_bytes=1000),
+    dict(chunk_bytes=1000, chunk_endswith='\n'),
+])
+def test_http_chunked_stream(chunks, http_server):
+    lines = [b'{"i": %d}\n' % i for i in range(20000)]
+    head, tail = b''.join(lines[:10000]), b''.join(lines[10000:])
+    first_read = threading.Event()
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            self.send_response(200)
+            if chunks.get('compression'):
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            # body has no length and its tail is sent only after client got its first chunk
+            if chunks.get('compression'):
+                compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+                self.wfile.write(compressor.compress(head) + compressor.flush(zlib.Z_SYNC_FLUSH))
+                first_read.wait(5)
+                self.wfile.write(compressor.compress(tail) + compressor.flush())
+            else:
+                self.wfile.write(head)
+                first_read.wait(5)
+                self.wfile.write(tail)
+
+    url = http_server(Handler)
+    try:
+        stream = Registry.create(Input, dict(type='http', url=url, **chunks))
+        payloads = [stream.fetch()]
+        assert payloads[0] is not None and not first_read.is_set()
+        first_read.set()
+        payloads.extend(iter(stream.fetch, None))
+        assert b''.join(payloads) == head + tail
+        assert all(len(payload) <= chunks.get('chunk_bytes', len(payload)) for payload in payloads)
+        if 'chunk_endswith' in chunks:
+            assert all(payload.endswith(b'\n') for payload in payloads)
+        if 'chunk_bytes' not in chunks:
+            assert payloads == lines
+    finally:
+        first_read.set()
+
+
+@pytest.mark.parametrize('pagination', [
+    dict(pagination='page', page_param='page', max_pages=10),
+    dict(pagination='page', page_param='page', split='json'),
+    dict(pagination='page', page_param='page', records_path='items', page_extractor=dict(type='jsonpath')),
+    dict(pagination='offset', page_param='offset', page_size=2, prefetch_pages=True, records_path='items',
+         page_extractor=dict(type='jsonpath')),
+    dict(pagination='link', prefetch_pages=True),
+    dict(pagination='cursor', page_param='cursor', cursor_path='"next": "([^"]+)"',
+         page_extractor=dict(type='regex', group=1)),
+])
+def test_http_pagination(pagination, http_server):
+    items = list(range(1, 8))
+    # pages past the end are not empty, but have no records
+    wrapped = pagination['pagination'] == 'cursor' or 'records_path' in pagination
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            query = dict(parse_qsl(urlsplit(self.path).query))
+            if 'cursor' in query or pagination['pagination'] == 'cursor':
+                start = int(query.get('cursor', 0))
+            elif 'offset' in query:
+                start = int(query['offset'])
+            else:
+                start = (int(query.get('page', 1)) - 1) * 2
+            page = items[start:start + 2]
+            body = json.dumps(page).encode()
+            self.send_response(200)
+            if pagination['pagination'] == 'cursor':
+                body = json.dumps({'items': page, **({'next': str(start + 2)} if start + 2 < len(items) else {})})
+                body = body.encode()
+            elif wrapped:
+                body = json.dumps({'items': page, 'total': len(items)}).encode()
+            if pagination['pagination'] == 'link' and start + 2 < len(items):
+                self.send_header('Link', f'</?page={start // 2 + 2}>; rel="next", </?page=1>; rel="first"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    url = http_server(Handler)
+    config = dict(type='http', url=url, **pagination)
+    pages = list(iter(Registry.create(Input, config).fetch, None))
+    if wrapped:
+        pages = [json.dumps(json.loads(page)['items']).encode() for page in pages]
+    if 'split' in pagination:
+        assert pages == [str(i).encode() for i in items]
+    else:
+        assert pages == [json.dumps(items[i:i + 2]).encode() for i in range(0, len(items), 2)]
+    limited = Registry.create(Input, dict(config, max_pages=2))
+    assert len(list(iter(limited.fetch, None))) == (4 if 'split' in pagination else 2)
+
+
+def test_failed_read_releases_prefetching(http_server):
+    class Handler(QuietHandler):
+        def do_GET(self):
+            page = int(dict(parse_qsl(urlsplit(self.path).query))['page'])
+            body = json.dumps({'id': page}).encode()
+            self.send_response(200 if page == 1 else 500)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    url = http_server(Handler)
+    b = Batch.from_config(dict(
+        inputs=dict(pages=dict(
+            type='http', url=url, pagination='page',
+            page_param='page', max_pages=3, prefetch_pages=True, retries=0,
+        )),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        columns=dict(id=dict(type='integer', path='id', extractor='first_match_in_json')),
+        maps=dict(pages=['id']),
+        tasks=dict(read_pages=dict(type='reader', inputs=['pages'])),
+    ))
+    with pytest.raises(HttpInputBadResponse):
+        b.run_once()
+    assert not [t for t in threading.enumerate() if t.name.startswith('batchout-http-prefetch')]
+
+
+def test_http_pagination_needs_end_of_pages():
+    with pytest.raises(HttpInputConfigInvalid):
+        Registry.create(Input, dict(type='http', url='http://127.0.0.1/', pagination='page', page_param='page'))
+
+
+@pytest.mark.parametrize('prefetch_pages', [False, True])
+def test_http_pagination_retries_failed_page_only(prefetch_pages, http_server):
+    requests, failed = [], set()
+
+    class Handler(QuietHandler):
+        def do_GET(self):
+            page = int(dict(parse_qsl(urlsplit(self.path).query))['page'])
+            requests.append(page)
+            body = json.dumps({'items': [{'id': page}] if page <= 4 else []}).encode()
+            # pages 2 and 3 fail once each, retries are counted per page
+            self.send_response(503 if page in (2, 3) and page not in failed else 200)
+            failed.add(page)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    b = Batch.from_config(dict(
+        inputs=dict(pages=dict(
+            type='http', url=http_server(Handler), pagination='page', page_param='page', records_path='items',
+            page_extractor=dict(type='jsonpath'), prefetch_pages=prefetch_pages, retries=1, max_backoff_sec=0,
+        )),
+        extractors=dict(first_match_in_json=dict(type='jsonpath')),
+        columns=dict(id=dict(type='integer', path='items[0].id', extractor='first_match_in_json')),
+        maps=dict(pages=['id']),
+        outputs=dict(recorder=dict(type='recorder')),
+        selectors=dict(all_ids=dict(type='sql', query='select id from pages order by id', columns=['id'])),
+        tasks=dict(
+            read_pages=dict(type='reader', inputs=['pages']),
+            record=dict(type='writer', selector='all_ids', outputs=['recorder']),
+        ),
+    )).with_stats()
+    b.run_once()
+    assert b._outputs['recorder'].rows == [(1,), (2,), (3,), (4,)]
+    assert requests == [1, 2, 2, 3, 3, 4, 5]
+    assert b.stats.get('task', 'read_pages', 'retry')['calls'] == 2
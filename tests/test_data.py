@@ -0,0 +1,53 @@
+import sqlite3
+from datetime import date, datetime, timezone
+
+from batchout.core.data import Data, ColumnBuffer
+
+
+def test_numeric_columns_are_buffered():
+    data = Data('n', 'x', 'ok', 's', n='integer', x='float', ok='boolean', s='string')
+    data.with_row('src', (1, 0.5, True, 'a'), (None, None, None, None), (3, 1.5, False, 'c'))
+
+    buffers = data.buffers('src')
+    assert isinstance(buffers['n'], ColumnBuffer) and buffers['n'].values.typecode == 'q'
+    assert isinstance(buffers['x'], ColumnBuffer) and buffers['x'].values.typecode == 'd'
+    assert isinstance(buffers['ok'], ColumnBuffer) and buffers['ok'].null_count == 1
+    assert list(buffers['s']) == ['a', None, 'c']
+
+    expected = [[1, 0.5, True, 'a'], [None, None, None, None], [3, 1.5, False, 'c']]
+    assert data.rows('src') == expected
+    merged = Data('n', 'x', 'ok', 's', n='integer', x='float', ok='boolean', s='string').with_data(data)
+    assert merged.count('src') == 3
+    assert list(map(list, merged.cursor.execute('select * from src'))) == expected
+    assert merged.rows('src') == expected
+
+
+def test_typed_columns_are_cast_back_by_declared_type():
+    data = Data('ok', 'd', 'ts', n='integer', ok='boolean', d='date', ts='datetime')
+    ts = datetime(2020, 1, 9, 12, tzinfo=timezone.utc)
+    data.with_row('src', (True, date(2020, 1, 9), ts), (None, None, None))
+
+    assert data.rows('src') == [[True, date(2020, 1, 9), ts], [None, None, None]]
+    assert list(data.cursor.execute('select ok, d, ts, typeof(d) from src')) == [
+        (True, date(2020, 1, 9), ts, 'text'),
+        (None, None, None, 'null'),
+    ]
+    assert list(data.cursor.execute('select ok as flag, ts as d from src where ok')) == [(True, ts)]
+    # standard type names of other connections are not affected
+    db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    db.execute('create table t(ok BOOLEAN)')
+    db.execute('insert into t values (1)')
+    assert [type(ok) for ok, in db.execute('select ok from t')] == [int]
+
+
+def test_aggregates_and_aliases_are_not_cast():
+    data = Data('ok', 'ts', ok='boolean', ts='datetime')
+    ts = datetime(2020, 1, 9, 12, tzinfo=timezone.utc)
+    data.with_row('src', (True, ts), (True, ts), (False, None))
+
+    assert list(data.cursor.execute('select count(*) as ok from src')) == [(3,)]
+    assert [type(ok) for ok, in data.cursor.execute('select sum(ok) as ok from src')] == [int]
+    assert list(data.cursor.execute('select sum(ok) as ok from src')) == [(2,)]
+    assert list(data.cursor.execute('select date(ts) as ts from src where ts is not null limit 1')) == [
+        ('2020-01-09',),
+    ]